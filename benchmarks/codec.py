@@ -0,0 +1,110 @@
+"""
+Micro-benchmark of the JSON codecs and the compression used by icp.codec
+
+Decodes and encodes payloads with every registered codec (the standard library, orjson when
+installed) and compresses them with gzip (and brotli when installed). Payloads are JSON files
+recorded from the API, e.g. with `curl ... > projects.json`; without arguments, samples built
+by the mock server are used (the `?pagination=0` project list, pages of invoices and orders).
+
+    python benchmarks/codec.py
+    python benchmarks/codec.py projects.json invoices.json --json codec.json
+"""
+import argparse
+import gzip
+import json
+import sys
+import timeit
+from os.path import join, dirname, abspath, basename
+
+from mock_server import make_invoice, make_order, make_project
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from icp import codec
+
+
+def sample_payloads(size):
+    return {
+        'projects (pagination=0)': json.dumps([make_project(i) for i in range(size)]).encode(),
+        'invoices page': json.dumps([make_invoice(i) for i in range(100)]).encode(),
+        'orders page': json.dumps({"orders": [make_order(i) for i in range(256)], "totalCount": size}).encode(),
+    }
+
+
+def seconds_per_call(function):
+    """
+    :return: Best time of a single call, seconds
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def compressors():
+    result = {'gzip': lambda data: gzip.compress(data, codec.GZIP_LEVEL)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        result['brotli'] = lambda data: brotli.compress(data, quality=5)
+    return result
+
+
+def measure(name, payload):
+    """
+    :return: List of result dictionaries of a payload
+    """
+    megabytes = len(payload) / 1e6
+    results = []
+    for codec_name, (loads, dumps) in codec.CODECS.items():
+        value = loads(payload)
+        decode = seconds_per_call(lambda: loads(payload))
+        encode = seconds_per_call(lambda: dumps(value))
+        results.append({
+            "payload": name, "kind": codec_name, "bytes": len(payload),
+            "decode_ms": round(decode * 1000, 2), "decode_mb_s": round(megabytes / decode, 1),
+            "encode_ms": round(encode * 1000, 2), "encode_mb_s": round(megabytes / encode, 1),
+        })
+    for compressor_name, compress in compressors().items():
+        compressed = compress(payload)
+        seconds = seconds_per_call(lambda: compress(payload))
+        results.append({
+            "payload": name, "kind": compressor_name, "bytes": len(compressed),
+            "ratio": round(len(payload) / len(compressed), 1), "compress_ms": round(seconds * 1000, 2),
+        })
+    return results
+
+
+def print_results(results):
+    for result in results:
+        if 'ratio' in result:
+            print(f"{result['payload']:<26} {result['kind']:<7} {result['bytes']:>10} bytes  "
+                  f"ratio {result['ratio']:>5}  {result['compress_ms']:>8} ms")
+        else:
+            print(f"{result['payload']:<26} {result['kind']:<7} {result['bytes']:>10} bytes  "
+                  f"decode {result['decode_ms']:>8} ms ({result['decode_mb_s']:>6} MB/s)  "
+                  f"encode {result['encode_ms']:>8} ms ({result['encode_mb_s']:>6} MB/s)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('payloads', nargs='*', help="recorded JSON responses, default: mock server samples")
+    parser.add_argument('--size', type=int, default=5000, help="projects in the sample project list")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.payloads:
+        payloads = {}
+        for path in args.payloads:
+            with open(path, 'rb') as f:
+                payloads[basename(path)] = f.read()
+    else:
+        payloads = sample_payloads(args.size)
+
+    print(f"selected codec: {codec.use()}")
+    results = [result for name, payload in payloads.items() for result in measure(name, payload)]
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,307 @@
+"""
+Local stand-in for the IC Project and Apilo APIs used by the examples
+
+Emulates the endpoints the scripts call, with generated data, configurable latency, page size
+limit and error rate. Every request is recorded (endpoint template, status, duration) so the
+benchmark can report request rates and latency percentiles.
+
+    python benchmarks/mock_server.py --port 8080 --latency 0.05
+
+then run a script with ICP_BASE_URL=http://127.0.0.1:8080 (and APILO_API_URL for the Apilo sync).
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# path regex -> endpoint template, the instance slug is stripped before matching
+ROUTES = [
+    (re.compile(r'^/finance/invoices$'), '/finance/invoices'),
+    (re.compile(r'^/finance/invoices/[^/]+$'), '/finance/invoices/{id}'),
+    (re.compile(r'^/finance/invoices/[^/]+/download-file$'), '/finance/invoices/{id}/download-file'),
+    (re.compile(r'^/finance/invoices/[^/]+/generate-pdf$'), '/finance/invoices/{id}/generate-pdf'),
+    (re.compile(r'^/finance/costs$'), '/finance/costs'),
+    (re.compile(r'^/finance/cost-categories$'), '/finance/cost-categories'),
+    (re.compile(r'^/finance/tax-rates$'), '/finance/tax-rates'),
+    (re.compile(r'^/project/projects$'), '/project/projects'),
+    (re.compile(r'^/project/tasks$'), '/project/tasks'),
+    (re.compile(r'^/project/task-templates$'), '/project/task-templates'),
+    (re.compile(r'^/project/boards/s/[^/]+/get-kanban-board$'), '/project/boards/s/{slug}/get-kanban-board'),
+    (re.compile(r'^/project/boards/[^/]+/board-columns$'), '/project/boards/{id}/board-columns'),
+    (re.compile(r'^/crm/contractors$'), '/crm/contractors'),
+    (re.compile(r'^/user/users$'), '/user/users'),
+]
+
+INSTANCE_PREFIX = re.compile(r'^/api/instance/[^/]*')
+
+# creation date of the first generated Apilo order, the next ones are a minute apart
+ORDERS_START = datetime(2024, 1, 1, tzinfo=timezone(timedelta(hours=1)))
+
+
+class MockConfig:
+    """
+    Behaviour of the mock server
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, max_page_size=100,
+                 invoices=1000, projects=1000, orders=1000, pdf_size=50 * 1024,
+                 ungenerated_rate=0.0, generation_delay=2.0):
+        self.latency = latency  # seconds added to every response
+        self.jitter = jitter  # random extra latency, up to this many seconds
+        self.error_rate = error_rate  # share of requests answered with 503
+        self.max_page_size = max_page_size  # itemsPerPage / limit is capped to this
+        self.invoices = invoices
+        self.projects = projects
+        self.orders = orders
+        self.pdf_size = pdf_size
+        self.ungenerated_rate = ungenerated_rate  # share of invoices listed without a generated PDF
+        self.generation_delay = generation_delay  # seconds from generate-pdf until the PDF is ready
+
+
+class RequestLog:
+    """
+    Thread-safe record of the handled requests
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []  # (method, endpoint, status, duration, bytes out)
+
+    def add(self, *entry):
+        with self.lock:
+            self.entries.append(entry)
+
+    def reset(self):
+        with self.lock:
+            self.entries = []
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.entries)
+
+
+def make_invoice(i, file_generated=True):
+    return {
+        "id": str(uuid.UUID(int=i + 1)),
+        "no": f"FV/{i + 1}/2024",
+        "fileGenerated": file_generated,
+        "buyerVatId": f"{1000000000 + i % 3000}",
+        "buyerName": f"Buyer {i % 3000}",
+        "toPay": 1230.0 + i % 100,
+        "alreadyPaid": 0.0,
+        "currencyCode": "PLN",
+        "dateDeadline": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}T00:00:00+01:00",
+        "dateIssue": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}T00:00:00+01:00",
+        "updatedAt": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}T12:00:00+01:00",
+        "sellerCreatorName": "Jan Kowalski",
+        "kind": "vat",
+        "description": "x" * 200,
+    }
+
+
+def make_project(i):
+    return {
+        "id": str(uuid.UUID(int=i + 1)),
+        "no": i + 1,
+        "name": f"Project {i + 1}",
+        "contractorId": None,
+        "contractorName": None,
+        "status": "open",
+        "userPermissions": ["read", "update"],
+        "category": {"name": "Default"} if i % 2 else None,
+        "dateStart": "2024-01-01",
+        "dateEnd": None,
+        "dateStartPlanned": "2024-01-01",
+        "dateEndPlanned": "2024-12-31",
+        "isFavorite": False,
+        "assignedProjectUsers": [
+            {"projectUser": {"firstName": f"First{u}", "lastName": f"Last{u}"}} for u in range(10)
+        ],
+        "progress": 50,
+        "budget": 10000,
+        "taskCountTotal": 10,
+        "taskCountDone": 5,
+        "timePlanned": 3600,
+        "timeReported": 1800,
+        "shortCode": f"P{i + 1}",
+        "tags": [{"name": f"tag{t}"} for t in range(5)],
+    }
+
+
+def make_order(i):
+    created_at = ORDERS_START + timedelta(minutes=i)
+    return {
+        "id": f"AL{i + 1:08d}",
+        "idExternal": f"EXT-{i + 1}",
+        "createdAt": created_at.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "addressCustomer": {"name": f"Customer {i}"},
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    # headers and body are written separately, with Nagle's algorithm the body waits for the delayed ACK
+    # of the headers and every keep-alive response stalls for tens of milliseconds
+    disable_nagle_algorithm = True
+    config = MockConfig()
+    log = RequestLog()
+    generated_at = {}  # invoice index -> time its PDF is ready, set by generate-pdf
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def handle_request(self, method):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        # repeated `name[]` parameters are kept as lists
+        query = {k: v if k.endswith('[]') else v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+
+        endpoint, status, body, content_type = self.route(method, url.path, query)
+
+        config = self.config
+        if config.latency or config.jitter:
+            time.sleep(config.latency + random.random() * config.jitter)
+        if config.error_rate and random.random() < config.error_rate:
+            status, body, content_type = 503, b'{"error": "unavailable"}', 'application/json'
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        self.log.add(method, endpoint, status, time.perf_counter() - started, len(body))
+
+    def route(self, method, path, query):
+        """
+        :return: (endpoint template, status, body, content type)
+        """
+        if path.startswith('/files/'):
+            return '/files/{id}.pdf', 200, b'%PDF' + b'0' * self.config.pdf_size, 'application/pdf'
+
+        if path.rstrip('/') == '/rest/api/orders':
+            first = 0
+            if 'createdAfter' in query:
+                created_after = datetime.strptime(query['createdAfter'], '%Y-%m-%dT%H:%M:%S%z')
+                first = max(0, int((created_after - ORDERS_START) // timedelta(minutes=1)) + 1)
+            offset = first + int(query.get('offset', 0))
+            limit = min(int(query.get('limit', self.config.max_page_size)), self.config.max_page_size)
+            orders = [make_order(i) for i in range(offset, min(offset + limit, self.config.orders))]
+            body = json_body({"orders": orders, "totalCount": max(0, self.config.orders - first)})
+            return '/rest/api/orders', 200, body, 'application/json'
+
+        path = INSTANCE_PREFIX.sub('', path)
+        for pattern, endpoint in ROUTES:
+            if pattern.match(path):
+                break
+        else:
+            return path, 404, b'{"error": "not found"}', 'application/json'
+
+        if method == 'POST':
+            return endpoint, 201, json_body({"id": str(uuid.uuid4())}), 'application/json'
+        if method == 'PATCH':
+            if endpoint == '/finance/invoices/{id}/generate-pdf':
+                index = uuid.UUID(path.split('/')[3]).int - 1
+                self.generated_at.setdefault(index, time.monotonic() + self.config.generation_delay)
+            return endpoint, 204, b'', 'application/json'
+
+        if endpoint == '/finance/invoices':
+            return endpoint, 200, json_body(self.page(self.invoice, self.config.invoices, query)), 'application/json'
+        if endpoint == '/finance/invoices/{id}':
+            return endpoint, 200, json_body(self.invoice(uuid.UUID(path.split('/')[3]).int - 1)), 'application/json'
+        if endpoint == '/project/projects':
+            return endpoint, 200, json_body(self.page(make_project, self.config.projects, query)), 'application/json'
+        if endpoint == '/finance/invoices/{id}/download-file':
+            host = self.headers.get('Host')
+            return endpoint, 200, json_body({"downloadUrl": f"http://{host}/files/{uuid.uuid4()}.pdf"}), \
+                'application/json'
+        if endpoint == '/project/boards/s/{slug}/get-kanban-board':
+            return endpoint, 200, json_body({"id": "board-1"}), 'application/json'
+        if endpoint == '/project/boards/{id}/board-columns':
+            return endpoint, 200, json_body([{"id": "column-1"}, {"id": "column-2"}]), 'application/json'
+        return endpoint, 200, b'[]', 'application/json'
+
+    def invoice(self, i):
+        """
+        Invoice number `i`; a share of them has no PDF until generate-pdf was requested and the delay passed
+        """
+        file_generated = (i * 7919 % 1000) >= self.config.ungenerated_rate * 1000 \
+            or time.monotonic() >= self.generated_at.get(i, float('inf'))
+        return make_invoice(i, file_generated)
+
+    def page(self, factory, total, query):
+        """
+        Items of the requested page; `pagination=0` returns the whole collection, `properties[]` selects fields
+        """
+        if query.get('pagination') == '0':
+            items = [factory(i) for i in range(total)]
+        else:
+            per_page = min(int(query.get('itemsPerPage', 30)), self.config.max_page_size)
+            start = (int(query.get('page', 1)) - 1) * per_page
+            items = [factory(i) for i in range(start, min(start + per_page, total))]
+        if 'properties[]' in query:
+            properties = query['properties[]']
+            items = [{key: item[key] for key in properties if key in item} for item in items]
+        return items
+
+
+def json_body(data):
+    return json.dumps(data).encode()
+
+
+def start_server(config, host='127.0.0.1', port=0):
+    """
+    Starts the mock server in a background thread
+
+    :param config: `MockConfig`
+    :return: (server, request log), `server.server_port` is the bound port
+    """
+    handler = type('Handler', (MockHandler,), {'config': config, 'log': RequestLog(), 'generated_at': {}})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, handler.log
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random extra latency, seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument('--max-page-size', type=int, default=100)
+    parser.add_argument('--invoices', type=int, default=1000)
+    parser.add_argument('--projects', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--ungenerated-rate', type=float, default=0.0, help="share of invoices without a PDF")
+    parser.add_argument('--generation-delay', type=float, default=2.0, help="seconds until a requested PDF is ready")
+    args = parser.parse_args()
+
+    server, _ = start_server(MockConfig(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, max_page_size=args.max_page_size,
+        invoices=args.invoices, projects=args.projects, orders=args.orders,
+        ungenerated_rate=args.ungenerated_rate, generation_delay=args.generation_delay,
+    ), port=args.port)
+    print(f"Mock ICP/Apilo API listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,303 @@
+"""
+Benchmarks of the example scripts against the local mock API (benchmarks/mock_server.py)
+
+Every scenario runs one script in a subprocess, in a temporary directory with generated input
+files, pointed at the mock server through ICP_BASE_URL / APILO_API_URL. Reported per scenario:
+rows/s, requests/s, errors, peak RSS of the script and p50/p99 request latency, measured by the server
+and by the script (its ICP_TRACE_FILE, see icp/telemetry.py).
+
+    python benchmarks/run.py --rows 5000 --latency 0.02
+    python benchmarks/run.py --scenarios import-contractors,import-costs --json results.json
+    python benchmarks/run.py --compare results.json  # exit code 1 when rows/s dropped by more than --tolerance
+
+The startup time of the `icp` command is checked as well: the exit code is 1 when `icp --help` takes
+more than --startup-budget seconds longer than starting a bare interpreter. --startup-only runs just
+that check, without the mock server and the scenarios, e.g. as a quick CI gate:
+
+    python benchmarks/run.py --startup-only
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import join, dirname, abspath
+
+from mock_server import MockConfig, start_server
+
+ROOT = abspath(join(dirname(__file__), '..'))
+
+# seconds `icp --help` may add to the start of a bare interpreter
+DEFAULT_STARTUP_BUDGET = 0.05
+STARTUP_RUNS = 10
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def setup_contractors(directory, rows):
+    write_csv(join(directory, 'sample-contractors.csv'), ['name', 'email', 'phone'],
+              ([f"Contractor {i}", f"c{i}@example.com", "123-456-789"] for i in range(rows)))
+
+
+def setup_users(directory, rows):
+    role = "3fa85f64-5717-4562-b3fc-2c963f66afa6"
+    write_csv(join(directory, 'sample-users.csv'),
+              ['email', 'firstName', 'lastName', 'canLogIn', 'phoneNumber', 'jobPosition', 'department', 'roleSets',
+               'hourlyRate'],
+              ([f"user{i}@example.com", "John", "Doe", "true", "123-456-7890", role, role, role, "30"]
+               for i in range(rows)))
+
+
+def setup_projects(directory, rows):
+    write_csv(join(directory, 'sample-projects.csv'),
+              ['project_name', 'date_start', 'date_end', 'description', 'status'],
+              ([f"Project {i}", "2024-01-01T00:00:00Z", "2024-12-31T00:00:00Z", "Description", "open"]
+               for i in range(rows)))
+
+
+def setup_costs(directory, rows):
+    write_csv(join(directory, 'sample-costs.csv'),
+              ['name', 'description', 'priceNet', 'priceGross', 'date', 'isBilled', 'isPosted', 'category', 'taxRate',
+               'taxRateValue', 'project'],
+              ([f"Cost {i}", "Description", "100", "123", "2024-09-18", "true", "false", f"Category {i % 10}", "23%",
+                "23", f"Project {i % 50 + 1}"] for i in range(rows)))
+
+
+# name -> (command, input setup, endpoint counted as a processed row)
+SCENARIOS = {
+    'download-invoices': (
+        [join(ROOT, 'python-download-all-invoices', 'main.py')],
+        None,
+        ('GET', '/files/{id}.pdf'),
+    ),
+    'unpaid-report': (
+        ['-c', "import importlib.util, sys; "
+               "spec = importlib.util.spec_from_file_location('cashcollector', sys.argv[1]); "
+               "m = importlib.util.module_from_spec(spec); spec.loader.exec_module(m); "
+               "m.create_xls(m.retrieve_unpaid_invoices())",
+         join(ROOT, 'python-export-unpaid-invoices-to-cashcollector-xls', 'main.py')],
+        None,
+        ('GET', '/finance/invoices'),
+    ),
+    'export-projects': (
+        [join(ROOT, 'python-export-projects-to-csv', 'export-projects-to-csv.py')],
+        None,
+        ('GET', '/project/projects'),
+    ),
+    'import-contractors': (
+        [join(ROOT, 'python-import-contractors-from-csv', 'import-contractors-from-csv.py')],
+        setup_contractors,
+        ('POST', '/crm/contractors'),
+    ),
+    'import-users': (
+        [join(ROOT, 'python-import-users-from-csv', 'import-users-from-csv.py')],
+        setup_users,
+        ('POST', '/user/users'),
+    ),
+    'import-projects': (
+        [join(ROOT, 'python-import-projects-from-csv', 'import-projects-from-csv.py')],
+        setup_projects,
+        ('POST', '/project/projects'),
+    ),
+    'import-costs': (
+        [join(ROOT, 'python-import-costs-from-csv', 'import-costs-from-csv.py')],
+        setup_costs,
+        ('POST', '/finance/costs'),
+    ),
+    'apilo-orders': (
+        [join(ROOT, 'python-export-orders-from-apilo-to-icp-tasks', 'export-orders-from-apilo-to-icp-tasks.py')],
+        None,
+        ('POST', '/project/tasks'),
+    ),
+}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def read_trace(path):
+    """
+    :return: Latencies of the requests traced by the script, seconds until the response headers arrived
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line)['latency'] for line in f if line.strip()]
+
+
+def run_scenario(name, config, rows):
+    """
+    Runs a single scenario against a fresh mock server
+
+    :return: Dictionary of measurements
+    """
+    command, setup, counted = SCENARIOS[name]
+    server, log = start_server(config)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    with tempfile.TemporaryDirectory() as directory:
+        if setup:
+            setup(directory, rows)
+
+        env = dict(
+            os.environ,
+            HOME=directory,  # keeps the on-disk HTTP cache of the scripts out of the real home directory
+            ICP_BASE_URL=base_url,
+            ICP_INSTANCE_SLUG="bench",
+            ICP_AUTHORIZATION_TOKEN="bench",
+            APILO_API_URL=base_url,
+            APILO_SYNC_STATE_PATH=join(directory, 'apilo-sync-state.sqlite3'),
+            ICP_TRACE_FILE=join(directory, 'trace.jsonl'),
+        )
+
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable] + command, cwd=directory, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = process.stderr.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.perf_counter() - started
+        client_durations = read_trace(env['ICP_TRACE_FILE'])
+
+    server.shutdown()
+    server.server_close()
+
+    entries = log.snapshot()
+    durations = [entry[3] for entry in entries]
+    if process.returncode:
+        processed = 0
+    elif counted == ('GET', '/finance/invoices'):
+        processed = config.invoices
+    elif counted == ('GET', '/project/projects'):
+        processed = config.projects
+    else:
+        processed = sum(1 for e in entries if (e[0], e[1]) == counted and 200 <= e[2] < 300)
+
+    if process.returncode:
+        print(f"{name}: exited with {process.returncode}\n{stderr.decode(errors='replace')[-2000:]}", file=sys.stderr)
+
+    return {
+        "scenario": name,
+        "exit_code": process.returncode,
+        "seconds": round(elapsed, 3),
+        "rows": processed,
+        "rows_per_second": round(processed / elapsed, 1),
+        "requests": len(entries),
+        "requests_per_second": round(len(entries) / elapsed, 1),
+        "errors": sum(1 for e in entries if e[2] >= 400),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),  # ru_maxrss is in KiB on Linux
+        "latency_p50_ms": round(percentile(durations, 50) * 1000, 2),
+        "latency_p99_ms": round(percentile(durations, 99) * 1000, 2),
+        "client_p50_ms": round(percentile(client_durations, 50) * 1000, 2),
+        "client_p99_ms": round(percentile(client_durations, 99) * 1000, 2),
+    }
+
+
+def print_results(results):
+    columns = ('seconds', 'rows', 'rows_per_second', 'requests', 'requests_per_second', 'errors', 'peak_rss_mb',
+               'latency_p50_ms', 'latency_p99_ms', 'client_p50_ms', 'client_p99_ms', 'exit_code')
+    name_width = max(len(name) for name in SCENARIOS)
+    print(f"{'scenario':<{name_width}}  " + "  ".join(columns))
+    for result in results:
+        print(f"{result['scenario']:<{name_width}}  " + "  ".join(f"{result[c]:>{len(c)}}" for c in columns))
+
+
+def startup_time(args, runs=STARTUP_RUNS):
+    """
+    :return: Shortest wall time of `runs` interpreter starts with the given arguments, in seconds
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    best = float('inf')
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + args, env=env, stdout=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def check_startup(budget):
+    """
+    Compares the startup of the `icp` command with a bare interpreter
+
+    :return: True when the difference fits in `budget` seconds
+    """
+    interpreter = startup_time(['-c', 'pass'])
+    overhead = {
+        'icp --help': startup_time(['-m', 'icp', '--help']) - interpreter,
+        'icp import-costs --help': startup_time(['-m', 'icp', 'import-costs', '--help']) - interpreter,
+    }
+    print(f"interpreter startup: {interpreter * 1000:.1f} ms")
+    for command, seconds in overhead.items():
+        print(f"{command}: +{seconds * 1000:.1f} ms (budget {budget * 1000:.0f} ms)")
+    return max(overhead.values()) <= budget
+
+
+def compare(results, baseline_path, tolerance):
+    """
+    :return: Names of the scenarios whose rows/s dropped more than `tolerance` below the baseline
+    """
+    with open(baseline_path) as f:
+        baseline = {r['scenario']: r for r in json.load(f)}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['scenario'])
+        if previous and result['rows_per_second'] < previous['rows_per_second'] * (1 - tolerance):
+            regressions.append(result['scenario'])
+            print(f"Regression in {result['scenario']}: {result['rows_per_second']} rows/s, "
+                  f"baseline {previous['rows_per_second']} rows/s")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS), help="comma separated, default: all")
+    parser.add_argument('--rows', type=int, default=2000, help="rows per CSV import and items per collection")
+    parser.add_argument('--latency', type=float, default=0.01, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random extra latency, seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument('--max-page-size', type=int, default=100)
+    parser.add_argument('--ungenerated-rate', type=float, default=0.0, help="share of invoices without a PDF")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--compare', help="baseline results file written by --json")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed rows/s drop against the baseline")
+    parser.add_argument('--startup-budget', type=float, default=DEFAULT_STARTUP_BUDGET,
+                        help="seconds `icp --help` may add to the interpreter startup")
+    parser.add_argument('--startup-only', action='store_true', help="only check the startup time, no scenarios")
+    args = parser.parse_args()
+
+    if args.startup_only:
+        if not check_startup(args.startup_budget):
+            print("The startup of the icp command exceeds its budget")
+            sys.exit(1)
+        sys.exit(0)
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        max_page_size=args.max_page_size, invoices=args.rows, projects=args.rows, orders=args.rows,
+                        ungenerated_rate=args.ungenerated_rate)
+
+    results = [run_scenario(name, config, args.rows) for name in args.scenarios.split(',')]
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    startup_ok = check_startup(args.startup_budget)
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+    if not startup_ok:
+        print("The startup of the icp command exceeds its budget")
+        sys.exit(1)
@@ -0,0 +1,29 @@
+"""
+Helpers shared by the IC Project API examples
+
+The example scripts add the repository root to `sys.path` and import from this package.
+The exports below are imported on first access, so `icp.cli` starts without loading requests.
+"""
+import importlib
+
+# exported name -> module defining it
+_EXPORTS = {
+    'IcpClient': 'icp.client',
+    'create_session': 'icp.client',
+    'ICP_BASE_URL': 'icp.client',
+    'iter_pages': 'icp.pagination',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module 'icp' has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,8 @@
+"""
+`python -m icp`, the same as the `icp` command
+"""
+import sys
+
+from icp.cli import main
+
+sys.exit(main())
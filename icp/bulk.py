@@ -0,0 +1,132 @@
+"""
+Bulk import engine shared by the CSV importers
+
+Rows are read lazily from any iterable (e.g. `csv.DictReader`) and sent by a bounded pool of
+worker threads, so the importer keeps the API busy without loading the whole file in memory.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from icp.governor import CircuitOpenError
+
+# number of rows sent in parallel
+DEFAULT_WORKERS = 8
+
+
+class RowResult:
+    """
+    Outcome of sending a single row
+    """
+    __slots__ = ('number', 'row', 'ok', 'status_code', 'response', 'error')
+
+    def __init__(self, number, row, ok, status_code=None, response=None, error=None):
+        self.number = number  # 1-based position of the row in the input
+        self.row = row
+        self.ok = ok
+        self.status_code = status_code
+        self.response = response
+        self.error = error  # error message, set when the row failed
+
+
+class ImportSummary:
+    """
+    Successes and failures collected by `import_rows`
+    """
+
+    def __init__(self):
+        self.succeeded = 0
+        self.failures = []
+        self.stopped = None  # reason the import ended before the last row, the rows left were not sent
+
+    @property
+    def failed(self):
+        return len(self.failures)
+
+    def add(self, result):
+        if result.ok:
+            self.succeeded += 1
+        else:
+            self.failures.append(result)
+
+    def print(self, label=lambda row: row):
+        """
+        Prints the totals and every failed row
+
+        :param label: Function returning a human readable name of a row
+        """
+        print(f"Import finished: {self.succeeded} succeeded, {self.failed} failed.")
+        if self.stopped:
+            print(f"Import stopped early, the remaining rows were not sent: {self.stopped}")
+        for result in sorted(self.failures, key=lambda r: r.number):
+            print(f"  row {result.number} ({label(result.row)}): {result.error}")
+
+
+def send_row(send, number, row):
+    """
+    Calls `send` for a single row and turns the response, or the exception raised, into a `RowResult`
+
+    :raise CircuitOpenError: The API is unavailable, the row was not sent
+    """
+    try:
+        response = send(row)
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        return RowResult(number, row, False, error=str(e))
+
+    if 200 <= response.status_code < 300:
+        return RowResult(number, row, True, response.status_code, response)
+
+    return RowResult(number, row, False, response.status_code, response,
+                     error=f"{response.status_code}, {response.text}")
+
+
+def import_rows(rows, send, workers=DEFAULT_WORKERS, on_result=None, numbered=False):
+    """
+    Sends every row with a bounded pool of worker threads
+
+    At most `2 * workers` rows are read ahead of the ones being sent, so memory use does not
+    depend on the size of the input. A row fails when `send` raises or the response status is
+    not 2xx; failures do not stop the import. A `CircuitOpenError` does: the rows not sent yet are
+    left out of the summary (and the journal), `summary.stopped` tells why.
+
+    :param rows: Iterable of rows, consumed lazily
+    :param send: Function sending a single row, returns `requests.Response`
+    :param workers: Number of rows sent in parallel
+    :param on_result: Optional callback receiving every `RowResult`, called from the calling thread
+    :param numbered: `rows` holds (row number, row) pairs, e.g. from `icp.journal.ImportJournal.pending`
+    :return: `ImportSummary`
+    """
+    summary = ImportSummary()
+    pending = {}  # futures of the rows being sent, in the order of the input
+
+    def collect(futures):
+        for future in futures:
+            try:
+                result = future.result()
+            except CircuitOpenError as e:
+                summary.stopped = summary.stopped or str(e)
+            else:
+                summary.add(result)
+                if on_result:
+                    on_result(result)
+            del pending[future]
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for number, row in rows if numbered else enumerate(rows, start=1):
+            pending[executor.submit(send_row, send, number, row)] = None
+
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            if summary.stopped:
+                break
+        else:
+            collect(list(pending))
+    finally:
+        # on a stop or an interrupt (Ctrl-C, an error of `rows`) the rows not started yet are dropped, and the
+        # ones already being sent are still collected, so `on_result` sees every row that reached the API
+        executor.shutdown(wait=True, cancel_futures=True)
+        collect([future for future in pending if not future.cancelled()])
+
+    return summary
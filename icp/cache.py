@@ -0,0 +1,43 @@
+"""
+In-memory memoization of lookups that rarely change during a run (boards, columns, templates)
+"""
+import functools
+import threading
+import time
+
+# how long a memoized value is reused, in seconds
+DEFAULT_TTL = 15 * 60
+
+
+def ttl_cache(ttl=DEFAULT_TTL):
+    """
+    Memoizes a function by its positional arguments for `ttl` seconds
+
+    `None` results are not cached, so a failed lookup is retried on the next call.
+    The wrapped function gets a `cache_clear()` method.
+
+    :param ttl: Time to live of a cached value, in seconds
+    :return: Decorator
+    """
+    def decorator(func):
+        lock = threading.Lock()
+        entries = {}
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            now = time.monotonic()
+            with lock:
+                entry = entries.get(args)
+            if entry and entry[0] > now:
+                return entry[1]
+
+            value = func(*args)
+            if value is not None:
+                with lock:
+                    entries[args] = (now + ttl, value)
+            return value
+
+        wrapper.cache_clear = entries.clear
+        return wrapper
+
+    return decorator
@@ -0,0 +1,101 @@
+"""
+The `icp` command, a single entry point for the example workflows
+
+    icp export-projects --output projects.csv.gz
+    icp download-invoices
+    icp unpaid-report
+    icp import-costs costs.csv --resume
+    icp multi-export projects --instances instances.csv
+
+Configuration is read once from the environment and a `.env` file in the working directory
+(`--env-file`), the variables already set win. Only argparse is loaded at startup: the script of
+a subcommand, and with it requests, openpyxl or python-dotenv, is imported when the subcommand runs,
+so `icp --help` and cron invocations that exit early stay cheap.
+"""
+import argparse
+import importlib
+import sys
+from os.path import exists
+
+# subcommand -> help, the script of `some-command` is the module `icp.scripts.some_command`
+COMMANDS = {
+    'download-invoices': "download the PDFs of all invoices",
+    'export-projects': "export projects to CSV/Parquet",
+    'unpaid-report': "mail the report of unpaid invoices",
+    'apilo-orders': "create tasks from new Apilo orders",
+    'import-contractors': "import contractors from CSV",
+    'import-costs': "import costs from CSV",
+    'import-projects': "import projects from CSV",
+    'import-users': "import users from CSV",
+    'multi-export': "export many instances at once",
+}
+
+# import subcommand -> module variable holding the default CSV file
+CSV_DEFAULTS = {
+    'import-contractors': 'CSV_FILE_PATH',
+    'import-costs': 'csv_file',
+    'import-projects': 'csv_file_path',
+    'import-users': 'CSV_FILE_PATH',
+}
+
+
+def load_env(path):
+    """
+    Loads a .env file into `os.environ` without overriding the variables already set
+    """
+    if exists(path):
+        from dotenv import load_dotenv
+        load_dotenv(path, override=False)
+
+
+def load_script(command):
+    """
+    Imports the script of a subcommand as `icp.scripts.<command>`, its `__main__` block is not run
+
+    The module has an importable name, so worker processes can unpickle its functions with any start method.
+    """
+    return importlib.import_module(f"icp.scripts.{command.replace('-', '_')}")
+
+
+def run(args):
+    """
+    :return: Exit code
+    """
+    module = load_script(args.command)
+    if args.command in CSV_DEFAULTS:
+        result = module.main(args.csv_file or getattr(module, CSV_DEFAULTS[args.command]), resume=args.resume)
+    elif args.command == 'export-projects':
+        result = module.main(args.output)
+    elif args.command == 'multi-export':
+        result = module.main(args.args)
+    else:
+        result = module.main()
+    return result or 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='icp', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--env-file', default='.env', help="variables loaded before running, default: .env")
+    commands = parser.add_subparsers(dest='command', required=True, metavar='command')
+
+    for command, help_ in COMMANDS.items():
+        subparser = commands.add_parser(command, help=help_, description=help_)
+        if command in CSV_DEFAULTS:
+            subparser.add_argument('csv_file', nargs='?', help="CSV file, default: the sample file of the script")
+            subparser.add_argument('--resume', action='store_true', help="continue an interrupted import")
+        elif command == 'export-projects':
+            subparser.add_argument('--output', help="destination file (.csv, .csv.gz or .parquet)")
+        elif command == 'multi-export':
+            subparser.add_argument('args', nargs=argparse.REMAINDER, help="arguments of multi-instance-export.py")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    load_env(args.env_file)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
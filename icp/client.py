@@ -0,0 +1,185 @@
+"""
+Shared HTTP client for the IC Project API examples
+
+Every example used to call module-level `requests.get/post/patch`, which opens a new TCP+TLS
+connection for each request. `IcpClient` keeps a pooled `requests.Session` instead, so
+connections to app.icproject.com are reused (keep-alive) and the auth headers are built once.
+
+https://developers.icproject.com/api-documentation/
+"""
+import os
+import tempfile
+
+import requests
+from icp import codec
+from icp.governor import GovernedAdapter
+from icp.http_cache import cached_request
+from icp.telemetry import get_default as get_default_telemetry
+
+# can be pointed at a test server, e.g. benchmarks/mock_server.py
+ICP_BASE_URL = os.environ.get("ICP_BASE_URL", "https://app.icproject.com")
+
+# number of keep-alive connections kept open per host
+DEFAULT_POOL_SIZE = 10
+
+# (connect, read) timeout in seconds
+DEFAULT_TIMEOUT = (5, 30)
+
+# size of the chunks written to disk by `IcpClient.download`
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def create_session(headers=None, pool_size=DEFAULT_POOL_SIZE, telemetry=None, governor=None):
+    """
+    Creates a `requests.Session` with a connection pool of the given size
+
+    Requests are paced by the rate governor of their host and throttled ones (429/503) are
+    retried, see `icp.governor`. Responses are requested compressed and `response.json()` uses
+    the fast JSON codec, see `icp.codec`.
+
+    :param headers: Headers sent with every request
+    :param pool_size: Maximum number of connections kept open per host
+    :param telemetry: `icp.telemetry.Telemetry` recording every request, by default the one
+        configured with ICP_METRICS_FILE / ICP_TRACE_FILE, if any
+    :param governor: `icp.governor.RateGovernor` used for every host, by default the process-wide one of each host
+    :return: Configured session
+    """
+    session = requests.Session()
+    adapter = GovernedAdapter(governor, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    codec.install(session)
+    if headers:
+        session.headers.update(headers)
+    telemetry = telemetry or get_default_telemetry()
+    if telemetry is not None:
+        telemetry.install(session)
+    return session
+
+
+class IcpClient:
+    """
+    Pooled client for a single IC Project instance
+
+    Paths passed to `get`, `post`, `patch` and `request` are relative to the instance API url,
+    e.g. `client.get("/finance/invoices")`.
+    """
+
+    def __init__(self, instance_slug, authorization_token, pool_size=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT, base_url=ICP_BASE_URL, cache=None, telemetry=None,
+                 compress_requests=None):
+        """
+        :param instance_slug: Slug of the IC Project instance
+        :param authorization_token: API token (X-Auth-Token)
+        :param pool_size: Maximum number of keep-alive connections
+        :param timeout: Default timeout for every request, seconds or (connect, read) tuple
+        :param base_url: IC Project url, without trailing slash
+        :param cache: Optional `icp.http_cache.HttpCache` for GET responses of reference endpoints
+        :param telemetry: Optional `icp.telemetry.Telemetry`, see `create_session`
+        :param compress_requests: Gzip large `json=` bodies, by default when ICP_GZIP_REQUESTS is set
+        """
+        self.instance_slug = instance_slug
+        self.api_url = f"{base_url}/api/instance/{instance_slug}"
+        self.timeout = timeout
+        self.cache = cache
+        if compress_requests is None:
+            compress_requests = bool(os.environ.get("ICP_GZIP_REQUESTS"))
+        self.compress_requests = compress_requests
+        self.session = create_session(
+            headers={
+                'X-Auth-Token': authorization_token,
+                'Accept': 'application/json',
+            },
+            pool_size=pool_size,
+            telemetry=telemetry,
+        )
+
+    def url(self, path):
+        """
+        Builds the full url of an API endpoint
+
+        :param path: Endpoint path, e.g. "/project/projects"
+        :return: Absolute url
+        """
+        return f"{self.api_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, **kwargs):
+        """
+        Sends a request to the instance API
+
+        A `json=` body is encoded with the fast JSON codec and gzipped when large, see `icp.codec`.
+
+        :param method: HTTP method
+        :param path: Endpoint path relative to the instance API url
+        :param kwargs: Passed through to `requests.Session.request`
+        :return: `requests.Response`
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        if kwargs.get('json') is not None:
+            body, headers = codec.encode_body(kwargs.pop('json'), compress=self.compress_requests)
+            kwargs['data'] = body
+            kwargs['headers'] = {**headers, **(kwargs.get('headers') or {})}
+        if self.cache is not None:
+            return cached_request(self.cache, self.session, method, path, self.url(path), **kwargs)
+        return self.session.request(method, self.url(path), **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def fetch(self, url, **kwargs):
+        """
+        GETs an absolute url outside the API (e.g. a signed file link) over the same pool,
+        without sending the auth token to a third party host
+
+        :param url: Absolute url
+        :param kwargs: Passed through to `requests.Session.get`
+        :return: `requests.Response`
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        headers = {'X-Auth-Token': None, **kwargs.pop('headers', {})}
+        return self.session.get(url, headers=headers, **kwargs)
+
+    def download(self, url, path, chunk_size=DOWNLOAD_CHUNK_SIZE, digest=None):
+        """
+        Streams an absolute url (see `fetch`) to a file in chunks
+
+        The body is written to a temporary file next to `path` and renamed into place only once
+        it is complete, so an interrupted download never leaves a truncated file behind.
+
+        :param url: Absolute url
+        :param path: Destination file
+        :param chunk_size: Size of the chunks read from the response
+        :param digest: Optional `hashlib` object updated with the content while it is written
+        :return: Destination file
+        """
+        with self.fetch(url, stream=True) as response:
+            response.raise_for_status()
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.', suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        return path
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
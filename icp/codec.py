@@ -0,0 +1,137 @@
+"""
+JSON codec and compression of the HTTP layer
+
+Responses of the sessions made by `create_session` decode `response.json()` with the fastest
+codec available: orjson when it is installed, the standard library otherwise (ICP_JSON_CODEC
+selects one by name, `register` adds others). `IcpClient` encodes `json=` request bodies with
+the same codec and gzips those over GZIP_MIN_SIZE bytes when asked to (ICP_GZIP_REQUESTS=1,
+the server must accept `Content-Encoding: gzip`).
+
+Compressed responses are requested explicitly with every encoding urllib3 can decode: gzip and
+deflate, and brotli when the brotli package is installed.
+
+    python benchmarks/codec.py  # decode/encode throughput and compression of sample payloads
+"""
+import gzip
+import json
+import os
+
+import requests
+from urllib3.util.request import ACCEPT_ENCODING
+
+# request bodies at least this large are gzipped when compression is enabled
+GZIP_MIN_SIZE = 16 * 1024
+GZIP_LEVEL = 6
+
+# name -> (loads taking bytes, dumps returning bytes)
+CODECS = {}
+
+
+def json_dumps(value):
+    # the same output as the encoder of requests, without the spaces
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), allow_nan=False).encode('utf-8')
+
+
+def register(name, loads, dumps):
+    """
+    Makes a codec available to `use`
+
+    :param name: Codec name
+    :param loads: Function decoding bytes, raising ValueError on invalid input
+    :param dumps: Function encoding a value to bytes, raising TypeError on unsupported values
+    """
+    CODECS[name] = (loads, dumps)
+
+
+register('json', json.loads, json_dumps)
+try:
+    import orjson
+except ImportError:
+    pass
+else:
+    register('orjson', orjson.loads, orjson.dumps)
+
+_name = None
+_loads = json.loads
+_dumps = json_dumps
+
+
+def use(name=None):
+    """
+    Selects the codec of the process
+
+    :param name: Registered codec, by default ICP_JSON_CODEC or the fastest one installed
+    :return: Name of the selected codec
+    """
+    global _name, _loads, _dumps
+    name = name or os.environ.get("ICP_JSON_CODEC") or ('orjson' if 'orjson' in CODECS else 'json')
+    if name not in CODECS:
+        raise ValueError(f"Unknown JSON codec {name!r}, available: {', '.join(CODECS)}")
+    _name = name
+    _loads, _dumps = CODECS[name]
+    return name
+
+
+use()
+
+
+def loads(data):
+    return _loads(data)
+
+
+def dumps(value):
+    """
+    :return: UTF-8 encoded JSON, values the codec does not support fall back to the standard library
+    """
+    try:
+        return _dumps(value)
+    except TypeError:
+        if _dumps is json_dumps:
+            raise
+        return json_dumps(value)
+
+
+def encode_body(value, compress=False, min_size=GZIP_MIN_SIZE):
+    """
+    Encodes a JSON request body
+
+    :param value: Body, e.g. the `json=` argument of a request
+    :param compress: Gzip the body when it has at least `min_size` bytes
+    :param min_size: Smallest body worth compressing
+    :return: (body bytes, headers to send with it)
+    """
+    body = dumps(value)
+    headers = {'Content-Type': 'application/json'}
+    if compress and len(body) >= min_size:
+        body = gzip.compress(body, GZIP_LEVEL)
+        headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+
+class JsonResponse(requests.Response):
+    """
+    `requests.Response` decoding `json()` with the selected codec
+    """
+
+    def json(self, **kwargs):
+        if kwargs or _name == 'json':
+            return super().json(**kwargs)
+        try:
+            return _loads(self.content)
+        except ValueError:
+            # not UTF-8 or not valid for this codec, requests raises its usual error if it fails too
+            return super().json()
+
+
+def install(session):
+    """
+    Makes `session` request compressed responses and decode them with the selected codec
+    """
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING.replace(',', ', ')
+    session.hooks['response'].append(use_codec)
+
+
+def use_codec(response, *args, **kwargs):
+    # JsonResponse adds no state, so the response built by the adapter can simply change its class
+    response.__class__ = JsonResponse
+    return response
@@ -0,0 +1,118 @@
+"""
+Column specs compiled into row extractors, and batched writers for CSV, gzip-compressed CSV and Parquet
+
+A column spec is a tuple of `(key, label, formatter)` or `(key, label, formatter, type)` entries:
+`key` is read from every record (None passes the whole record to the formatter), the optional
+`formatter` converts the value and `type` is the Arrow type of the column in Parquet files
+("string" when omitted). The spec is compiled once into a single function, so extracting a row
+does not loop over the columns or look them up again.
+"""
+import csv
+import gzip
+from itertools import islice
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _compile(columns, template, name):
+    namespace = {}
+    values = []
+    for i, column in enumerate(columns):
+        key, formatter = column[0], column[2]
+        value = "record" if key is None else f"record[{key!r}]"
+        if formatter:
+            namespace[f"format_{i}"] = formatter
+            value = f"format_{i}({value})"
+        values.append(value)
+    source = f"def {name}(record):\n    return {template(values)}\n"
+    exec(compile(source, f"<{name}>", "exec"), namespace)
+    return namespace[name]
+
+
+def compile_columns(columns):
+    """
+    :param columns: Column spec
+    :return: Function turning a record into the list of its column values
+    """
+    return _compile(columns, lambda values: f"[{', '.join(values)}]", "extract_row")
+
+
+def compile_mapping(fields):
+    """
+    Compiles `(target, key, formatter)` entries into a function building a dictionary, e.g. an API payload
+    from a CSV row
+
+    :param fields: Entries of the target key, source key (None for the whole record) and optional formatter
+    :return: Function turning a record into a dictionary
+    """
+    columns = [(key, target, formatter) for target, key, formatter in fields]
+    return _compile(
+        columns,
+        lambda values: "{" + ", ".join(f"{column[1]!r}: {value}" for column, value in zip(columns, values)) + "}",
+        "build_record",
+    )
+
+
+def labels(columns):
+    return [column[1] for column in columns]
+
+
+def batches(records, size=DEFAULT_BATCH_SIZE):
+    records = iter(records)
+    while batch := list(islice(records, size)):
+        yield batch
+
+
+def write_rows(path, columns, records, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    """
+    Writes records in batches, the format follows the file extension: .csv, .csv.gz or .parquet
+
+    :param path: Destination file
+    :param columns: Column spec
+    :param records: Iterable of records, consumed lazily
+    :param batch_size: Records converted and written at once
+    :param on_batch: Optional callback receiving the number of records written so far
+    :return: Number of written records
+    """
+    extract = compile_columns(columns)
+    if path.endswith('.parquet'):
+        return write_parquet(path, columns, records, extract, batch_size, on_batch)
+
+    opener = gzip.open if path.endswith('.gz') else open
+    count = 0
+    with opener(path, 'wt', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=',', quotechar='"')
+        writer.writerow(labels(columns))
+        for batch in batches(records, batch_size):
+            writer.writerows([extract(record) for record in batch])
+            count += len(batch)
+            if on_batch:
+                on_batch(count)
+    return count
+
+
+def write_parquet(path, columns, records, extract, batch_size, on_batch):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet output requires pyarrow, install it with `pip install pyarrow`") from None
+
+    types = [pa.type_for_alias(column[3] if len(column) > 3 else "string") for column in columns]
+    schema = pa.schema([pa.field(label, type_) for label, type_ in zip(labels(columns), types)])
+
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches(records, batch_size):
+            # rows are transposed into one array per column
+            values = zip(*[extract(record) for record in batch])
+            arrays = []
+            for type_, column in zip(types, values):
+                if pa.types.is_string(type_):
+                    column = [v if v is None or isinstance(v, str) else str(v) for v in column]
+                arrays.append(pa.array(column, type=type_))
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            count += len(batch)
+            if on_batch:
+                on_batch(count)
+    return count
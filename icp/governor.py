@@ -0,0 +1,318 @@
+"""
+Adaptive rate governor shared by every session of the process
+
+`create_session` mounts a `GovernedAdapter`, so every request to a host goes through the same
+`RateGovernor`, whichever thread or client sends it. The governor
+
+- spaces requests with a token bucket (ICP_RATE_LIMIT requests per second, unlimited by default),
+- pauses all requests to the host for the `Retry-After` of a 429/503 response (an exponential backoff for
+  a 429 without it),
+- adapts the number of requests in flight AIMD-style: +1 per round of fast successful responses,
+  halved on throttling and reduced when recent latency grows well above the long-term average
+  (ICP_MAX_CONCURRENCY caps it),
+- opens a circuit breaker after a run of 5xx responses or connection errors; requests then wait for
+  a probe request sent after the cooldown and go on once it succeeds, a request still waiting after
+  ICP_BREAKER_WAIT seconds (120 by default, 0 fails fast) fails with `CircuitOpenError`.
+
+Throttled requests (429/503) are retried by the adapter; 502/504 and connection errors are
+retried for idempotent methods only, so a POST that may have been processed is never sent twice.
+"""
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# requests in flight per host, the adaptive limit stays between the minimum and the maximum
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_MIN_CONCURRENCY = 1
+
+# attempts after the first one
+DEFAULT_MAX_RETRIES = 5
+
+# seconds of pause after a 429 without Retry-After, doubled on every consecutive one
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+# seconds before retrying a single request after a 5xx without Retry-After or a connection error, doubled per attempt
+RETRY_BACKOFF = 0.25
+
+# consecutive 5xx responses / connection errors opening the circuit, and seconds it stays open
+DEFAULT_BREAKER_THRESHOLD = 10
+DEFAULT_BREAKER_COOLDOWN = 30.0
+
+# seconds a request waits for the circuit to close before failing with CircuitOpenError
+DEFAULT_BREAKER_WAIT = 120.0
+
+# recent latency this many times above the long-term average counts as congestion
+SLOW_FACTOR = 2.0
+
+# weights of a new sample in the recent and the long-term latency averages
+RECENT_WEIGHT = 0.2
+BASELINE_WEIGHT = 0.01
+
+THROTTLE_STATUSES = frozenset((429, 503))
+RETRY_STATUSES = frozenset((429, 502, 503, 504))
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request when the circuit of its host stays open longer than the caller can wait
+    """
+
+
+def parse_retry_after(value):
+    """
+    :param value: `Retry-After` header, seconds or an HTTP date
+    :return: Seconds to wait, or None when missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateGovernor:
+    """
+    Token bucket, adaptive concurrency limit and circuit breaker of a single host, safe to share between threads
+    """
+
+    def __init__(self, rate=None, burst=None, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 min_concurrency=DEFAULT_MIN_CONCURRENCY, breaker_threshold=DEFAULT_BREAKER_THRESHOLD,
+                 breaker_cooldown=DEFAULT_BREAKER_COOLDOWN, breaker_wait=DEFAULT_BREAKER_WAIT):
+        """
+        :param rate: Requests per second, None for no limit
+        :param burst: Requests sent at once after an idle period, by default one second worth of `rate`
+        :param max_concurrency: Upper bound of the requests in flight
+        :param min_concurrency: Lower bound the limit is decreased to
+        :param breaker_threshold: Consecutive 5xx responses or connection errors opening the circuit
+        :param breaker_cooldown: Seconds the circuit stays open before a probe request is let through
+        :param breaker_wait: Seconds `acquire` waits for the circuit to close, 0 fails right away while it is open
+        """
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.tokens = self.burst
+        self.refilled_at = time.monotonic()
+
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.recent_latency = None  # seconds, exponentially weighted averages
+        self.baseline_latency = None
+        self.decreased_at = 0.0
+
+        self.paused_until = 0.0
+        self.throttled = 0  # consecutive throttled responses
+
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.breaker_wait = breaker_wait
+        self.failures = 0  # consecutive 5xx responses and connection errors, kept until the circuit closes
+        self.state = 'closed'  # closed, open or half-open
+        self.opened_at = 0.0
+        self.probing = False
+
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent
+
+        While the circuit is open, the request waits for the probe sent after the cooldown and is let
+        through once the probe succeeds.
+
+        :raise CircuitOpenError: The circuit stays open longer than `breaker_wait` seconds
+        """
+        with self.condition:
+            deadline = time.monotonic() + self.breaker_wait
+            while True:
+                now = time.monotonic()
+                if self.state == 'open':
+                    closes_at = self.opened_at + self.breaker_cooldown
+                    if closes_at > deadline:
+                        raise CircuitOpenError(f"Circuit open after {self.failures} consecutive failures, "
+                                               f"retry in {closes_at - now:.1f}s")
+                    if now < closes_at:
+                        self.condition.wait(closes_at - now)
+                        continue
+                    self.state = 'half-open'
+
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                    continue
+
+                # a single probe request is sent while half-open, the others wait for its outcome
+                if (self.state == 'half-open' and self.probing) or self.in_flight >= int(self.limit):
+                    self.condition.wait(1.0)
+                    continue
+
+                if self.rate:
+                    self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+                    self.refilled_at = now
+                    if self.tokens < 1:
+                        self.condition.wait((1 - self.tokens) / self.rate)
+                        continue
+                    self.tokens -= 1
+
+                if self.state == 'half-open':
+                    self.probing = True
+                self.in_flight += 1
+                return
+
+    def release(self, status, latency, retry_after=None):
+        """
+        Records the outcome of a request sent after `acquire`
+
+        :param status: Response status code, None for a connection error or timeout
+        :param latency: Seconds until the response headers arrived
+        :param retry_after: `Retry-After` header of the response
+        """
+        with self.condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            probe = self.probing
+            self.probing = False
+
+            if status in THROTTLE_STATUSES:
+                self.throttled += 1
+                pause = parse_retry_after(retry_after)
+                if pause is None and status == 429:
+                    pause = min(MAX_BACKOFF, DEFAULT_BACKOFF * 2 ** (self.throttled - 1))
+                if pause is not None:
+                    self.paused_until = max(self.paused_until, now + pause)
+                self.decrease(now, latency, 0.5)
+            elif status is None or status >= 500:
+                self.decrease(now, latency, 0.5)
+            else:
+                self.throttled = 0
+                if self.baseline_latency is None:
+                    self.recent_latency = self.baseline_latency = latency
+                self.recent_latency += RECENT_WEIGHT * (latency - self.recent_latency)
+                self.baseline_latency += BASELINE_WEIGHT * (latency - self.baseline_latency)
+                if self.recent_latency > SLOW_FACTOR * self.baseline_latency:
+                    self.decrease(now, latency, 0.9)
+                else:
+                    # additive increase, about +1 per round of `limit` requests
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+            if status is None or status >= 500:
+                self.failures += 1
+                if probe or self.failures >= self.breaker_threshold:
+                    self.state = 'open'
+                    self.opened_at = now
+            else:
+                if probe:
+                    self.state = 'closed'
+                # a success of a request sent before the circuit opened does not close it
+                if self.state == 'closed':
+                    self.failures = 0
+
+            self.condition.notify_all()
+
+    def cancel(self):
+        """
+        Gives back the slot taken by `acquire` when the request could not be sent at all
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.probing = False
+            self.condition.notify_all()
+
+    def decrease(self, now, latency, factor):
+        """
+        Multiplicative decrease, at most once per round trip so a burst of throttled responses counts once
+        """
+        if now - self.decreased_at >= latency:
+            self.limit = max(self.min_concurrency, self.limit * factor)
+            self.decreased_at = now
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(host):
+    """
+    Process-wide `RateGovernor` of a host, configured with ICP_RATE_LIMIT, ICP_RATE_BURST, ICP_MAX_CONCURRENCY
+    and ICP_BREAKER_WAIT
+    """
+    with _governors_lock:
+        if host not in _governors:
+            _governors[host] = RateGovernor(
+                rate=float(os.environ.get("ICP_RATE_LIMIT") or 0) or None,
+                burst=float(os.environ.get("ICP_RATE_BURST") or 0) or None,
+                max_concurrency=int(os.environ.get("ICP_MAX_CONCURRENCY") or DEFAULT_MAX_CONCURRENCY),
+                breaker_wait=float(os.environ.get("ICP_BREAKER_WAIT") or DEFAULT_BREAKER_WAIT),
+            )
+        return _governors[host]
+
+
+class GovernedAdapter(HTTPAdapter):
+    """
+    `HTTPAdapter` sending every request through the `RateGovernor` of its host and retrying throttled ones
+
+    The number of retries is stored in `response.governor_retries`.
+    """
+
+    def __init__(self, governor=None, retries=DEFAULT_MAX_RETRIES, **kwargs):
+        """
+        :param governor: `RateGovernor` used for every host, by default the process-wide one of each host
+        :param retries: Attempts after the first one
+        :param kwargs: Passed through to `HTTPAdapter`
+        """
+        super().__init__(**kwargs)
+        self.governor = governor
+        self.retries = retries
+
+    def send(self, request, **kwargs):
+        governor = self.governor or get_governor(urlsplit(request.url).netloc)
+        # streamed bodies (generators, files) cannot be sent twice
+        replayable = request.body is None or isinstance(request.body, (bytes, str))
+        idempotent = request.method in IDEMPOTENT_METHODS
+
+        attempt = 0
+        while True:
+            governor.acquire()
+            started = time.monotonic()
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                governor.release(None, time.monotonic() - started)
+                if attempt >= self.retries or not (replayable and idempotent):
+                    raise
+                attempt += 1
+                time.sleep(min(MAX_BACKOFF, RETRY_BACKOFF * 2 ** (attempt - 1)))
+                continue
+            except BaseException:
+                governor.cancel()
+                raise
+            governor.release(response.status_code, time.monotonic() - started, response.headers.get('Retry-After'))
+
+            retry = (
+                response.status_code in RETRY_STATUSES
+                and attempt < self.retries
+                and replayable
+                and (idempotent or response.status_code in THROTTLE_STATUSES)
+            )
+            if not retry:
+                response.governor_retries = attempt
+                return response
+
+            # the body is read so the connection goes back to the pool
+            response.content
+            response.close()
+            attempt += 1
+            if response.status_code != 429 and parse_retry_after(response.headers.get('Retry-After')) is None:
+                time.sleep(min(MAX_BACKOFF, RETRY_BACKOFF * 2 ** (attempt - 1)))
+            # otherwise the governor pauses the host for Retry-After before the next attempt is let through
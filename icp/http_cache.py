@@ -0,0 +1,187 @@
+"""
+Persistent on-disk cache of GET responses for reference endpoints (categories, tax rates, boards...)
+
+Only endpoints listed in `ttls` are cached. A cached response younger than its TTL is returned
+without any request; an older one (any one with TTL 0) is revalidated with If-None-Match /
+If-Modified-Since and reused when the server answers 304 Not Modified. Entries are evicted least recently used first once the
+cache grows past `max_bytes`. Any POST/PATCH/PUT/DELETE to a path drops the cached responses under it.
+"""
+import fnmatch
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from icp.codec import JsonResponse
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "icp-api-examples", "http-cache.sqlite3")
+
+# total size of the cached bodies, in bytes
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# endpoint pattern (fnmatch, relative to the instance API url) -> seconds a response is used without revalidation;
+# lookups deciding what an import creates or links to are revalidated on every request (TTL 0), since the
+# entities may be created elsewhere, e.g. projects by import-projects, without invalidating this cache
+DEFAULT_TTLS = {
+    "/finance/cost-categories": 0,
+    "/finance/tax-rates": 0,
+    "/project/projects": 0,
+    "/project/task-templates": 60 * 60,
+    "/project/boards/s/*/get-kanban-board": 60 * 60,
+    "/project/boards/*/board-columns": 60 * 60,
+}
+
+
+class HttpCache:
+    """
+    SQLite backed response cache, safe to share between threads
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttls=None, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param path: SQLite file, created when missing
+        :param ttls: Endpoint pattern -> TTL in seconds, only matching endpoints are cached
+        :param max_bytes: Size limit of the cached bodies
+        """
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    headers TEXT,
+                    body BLOB,
+                    size INTEGER,
+                    stored_at REAL,
+                    accessed_at REAL
+                )
+            """)
+
+    def ttl(self, path):
+        """
+        :param path: Endpoint path
+        :return: TTL of the endpoint, or None when it is not cached
+        """
+        path = '/' + path.lstrip('/')
+        for pattern, ttl in self.ttls.items():
+            if fnmatch.fnmatchcase(path, pattern):
+                return ttl
+        return None
+
+    def get(self, url):
+        """
+        :param url: Full url including the query string
+        :return: (response, age in seconds) or None
+        """
+        with self.lock, self.db:
+            row = self.db.execute("SELECT headers, body, stored_at FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (time.time(), url))
+        headers, body, stored_at = row
+        return build_response(url, json.loads(headers), body), time.time() - stored_at
+
+    def touch(self, url):
+        """
+        Marks a cached response as fresh again, after a 304 Not Modified
+        """
+        with self.lock, self.db:
+            self.db.execute("UPDATE responses SET stored_at = ? WHERE url = ?", (time.time(), url))
+
+    def store(self, url, response):
+        body = response.content
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (url, headers, body, size, stored_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, json.dumps(dict(response.headers)), body, len(body), now, now)
+            )
+            self.evict()
+
+    def evict(self):
+        """
+        Drops least recently used responses until the cache fits in `max_bytes`, call with the lock held
+        """
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        for url, size in self.db.execute("SELECT url, size FROM responses ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM responses WHERE url = ?", (url,))
+            total -= size
+
+    def invalidate(self, url):
+        """
+        Drops every cached response whose url starts with `url`
+        """
+        pattern = url.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM responses WHERE url LIKE ? ESCAPE '\\'", (pattern,))
+
+    def close(self):
+        self.db.close()
+
+
+def build_response(url, headers, body):
+    """
+    Rebuilds a `requests.Response` from a cached entry
+    """
+    response = JsonResponse()
+    response.status_code = 200
+    response.url = url
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = body
+    return response
+
+
+def cached_request(cache, session, method, path, url, **kwargs):
+    """
+    Sends a request through the cache, used by `IcpClient.request`
+
+    :param cache: `HttpCache`
+    :param session: `requests.Session` sending the request
+    :param method: HTTP method
+    :param path: Endpoint path, matched against the cache TTLs
+    :param url: Full url of the endpoint, without the query string
+    :param kwargs: Passed through to `requests.Session.request`
+    :return: `requests.Response`
+    """
+    if method != 'GET':
+        response = session.request(method, url, **kwargs)
+        if response.ok:
+            cache.invalidate(url)
+        return response
+
+    ttl = cache.ttl(path)
+    if ttl is None or kwargs.get('stream'):
+        return session.request(method, url, **kwargs)
+
+    key = requests.Request(method, url, params=kwargs.get('params')).prepare().url
+    cached = cache.get(key)
+    if cached:
+        cached_response, age = cached
+        if age < ttl:
+            return cached_response
+
+        # revalidate a stale response
+        headers = dict(kwargs.pop('headers', None) or {})
+        if 'ETag' in cached_response.headers:
+            headers['If-None-Match'] = cached_response.headers['ETag']
+        if 'Last-Modified' in cached_response.headers:
+            headers['If-Modified-Since'] = cached_response.headers['Last-Modified']
+        kwargs['headers'] = headers
+
+    response = session.request(method, url, **kwargs)
+    if response.status_code == 304 and cached:
+        cache.touch(key)
+        return cached[0]
+    if response.status_code == 200:
+        cache.store(key, response)
+    return response
@@ -0,0 +1,211 @@
+"""
+Crash-safe journal of the CSV importers
+
+Every row created by an import is appended to a journal file next to the CSV file
+(`<file>.journal`, one JSON line per row: row number, byte offset of its end, hash of its
+fields and id of the created entity), after a first line with the size and modification time
+of the CSV file. Resuming an interrupted import seeks straight past the rows completed without
+gaps and skips the ones completed out of order after them, so the completed part of the file is
+not read again; it is refused when the CSV file changed since the journal was started.
+
+Lines are flushed and fsynced in batches. An interrupt (Ctrl-C) journals the rows still being
+sent, but a crash or a kill loses the last batch, and its rows are sent again on resume. The
+journal is removed once every row of the file was imported.
+"""
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+
+# journal lines written between two fsyncs, and the longest time between them in seconds
+DEFAULT_SYNC_EVERY = 100
+DEFAULT_SYNC_INTERVAL = 1.0
+
+
+def row_hash(row):
+    return hashlib.blake2b('\x1f'.join(row).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def csv_identity(path):
+    """
+    :return: Size and modification time of a file, they change whenever it is rewritten
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_csv(path, offset=0):
+    """
+    Reads the rows of a CSV file together with the byte offset where each one ends
+
+    :param path: CSV file with a header row
+    :param offset: Byte offset to continue from, 0 reads the file from the first row
+    :return: (header, generator of (end offset, row list))
+    """
+    f = open(path, 'rb')
+    position = 0
+
+    def lines():
+        nonlocal position
+        for line in f:
+            position += len(line)
+            yield line.decode('utf-8')
+
+    reader = csv.reader(lines())
+    header = next(reader, [])
+    if header:
+        header[0] = header[0].lstrip('\ufeff')
+    if offset:
+        f.seek(offset)
+        position = offset
+
+    def rows():
+        with f:
+            for row in reader:
+                yield position, row
+
+    return header, rows()
+
+
+class ImportJournal:
+    """
+    Append-only journal of the rows completed by an import, see `pending` and `record`
+    """
+
+    def __init__(self, csv_path, resume=False, path=None, sync_every=DEFAULT_SYNC_EVERY,
+                 sync_interval=DEFAULT_SYNC_INTERVAL):
+        """
+        :param csv_path: Imported CSV file
+        :param resume: Continue the import recorded in an existing journal
+        :param path: Journal file, by default `<csv_path>.journal`
+        :param sync_every: Lines written between two fsyncs
+        :param sync_interval: Longest time between two fsyncs, seconds
+        :raise FileExistsError: A journal exists and `resume` is not set
+        :raise ValueError: The CSV file changed since the journal was started
+        """
+        self.csv_path = csv_path
+        self.path = path or f"{csv_path}.journal"
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.done = {}  # row number -> (end offset, hash), read from the journal
+        self.in_flight = {}  # row number -> (end offset, hash) of the rows handed out by `pending`
+        self.read_all = False  # `pending` reached the end of the file
+        self.failed = 0  # rows handed out by `pending` and not imported
+
+        identity = csv_identity(csv_path)
+        if os.path.exists(self.path):
+            if not resume:
+                raise FileExistsError(f"{self.path} of a previous import exists, "
+                                      f"run with --resume to continue it or delete it to start over")
+            stored, self.done = self.load()
+            # journals written before the identity was stored cannot be checked
+            if stored is not None and stored != identity:
+                raise ValueError(f"{csv_path} changed since {self.path} was written, "
+                                 f"delete the journal to import the file from the start")
+
+        self.file = open(self.path, 'a', encoding='utf-8')
+        if not self.file.tell():
+            self.file.write(json.dumps({"csv": identity}) + "\n")
+        elif not self.ends_with_newline():
+            # terminate a line torn by a crash, so the next one stays readable
+            self.file.write("\n")
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def load(self):
+        """
+        :return: (identity of the CSV file or None, completed rows)
+        """
+        identity = None
+        done = {}
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be torn by a crash
+                    continue
+                if 'csv' in entry:
+                    identity = entry['csv']
+                else:
+                    done[entry['row']] = (entry['end'], entry['hash'])
+        return identity, done
+
+    def ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def pending(self, as_dict=True):
+        """
+        Yields the rows not completed yet, numbered from 1 like the rows of the whole file
+
+        :param as_dict: Yield rows as dictionaries keyed by the header, lists otherwise
+        :return: Generator of (row number, row), for `import_rows(..., numbered=True)`
+        """
+        # rows 1..completed were all sent, reading continues right after them
+        completed = 0
+        while completed + 1 in self.done:
+            completed += 1
+        header, rows = read_csv(self.csv_path, self.done[completed][0] if completed else 0)
+
+        for number, (end, row) in enumerate(rows, start=completed + 1):
+            digest = row_hash(row)
+            if number in self.done:
+                if self.done[number][1] != digest:
+                    raise ValueError(f"Row {number} of {self.csv_path} changed since {self.path} was written")
+                continue
+            with self.lock:
+                self.in_flight[number] = (end, digest)
+            yield number, dict(zip(header, row)) if as_dict else row
+        self.read_all = True
+
+    def record(self, result):
+        """
+        Journals a successfully sent row, pass it `RowResult`s (e.g. from the `on_result` callback)
+        """
+        with self.lock:
+            end, digest = self.in_flight.pop(result.number)
+            if not result.ok:
+                self.failed += 1
+                return
+            try:
+                entity_id = result.response.json().get('id')
+            except (ValueError, AttributeError):
+                entity_id = None
+            self.file.write(json.dumps({"row": result.number, "end": end, "hash": digest, "id": entity_id}) + "\n")
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every or time.monotonic() - self.synced_at >= self.sync_interval:
+                self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    @property
+    def complete(self):
+        """
+        Every row of the file was imported, by this run or the ones before it
+        """
+        return self.read_all and not self.in_flight and not self.failed
+
+    def close(self):
+        """
+        Closes the journal, and removes it when the import is complete so the next import of the file starts over
+        """
+        with self.lock:
+            self.sync()
+            self.file.close()
+            if self.complete:
+                os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
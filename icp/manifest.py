@@ -0,0 +1,57 @@
+"""
+Index of files downloaded by a sync, keyed by the id of the entity they belong to
+
+Stores name, `updatedAt`, path, size and SHA-256 checksum of every file next to the marks of
+`SyncState`, so a rerun only lists entities changed since the last sync and only re-downloads
+files whose entity was modified after the download.
+"""
+from icp.sync_state import SyncState
+
+
+class FileManifest(SyncState):
+    """
+    Downloaded files and sync marks in one SQLite file, safe to share between threads
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id TEXT PRIMARY KEY,
+                    name TEXT,
+                    updated_at TEXT,
+                    path TEXT,
+                    size INTEGER,
+                    sha256 TEXT
+                )
+            """)
+
+    def get(self, entity_id):
+        """
+        :param entity_id: Id of the entity the file belongs to
+        :return: Dictionary with name, updated_at, path, size and sha256, or None
+        """
+        with self.lock:
+            row = self.db.execute("SELECT name, updated_at, path, size, sha256 FROM files WHERE id = ?",
+                                  (str(entity_id),)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('name', 'updated_at', 'path', 'size', 'sha256'), row))
+
+    def put(self, entity_id, name, updated_at, path, size, sha256):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files (id, name, updated_at, path, size, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+                (str(entity_id), name, updated_at, path, size, sha256)
+            )
+
+    def entries(self):
+        """
+        :return: List of dictionaries with id, name, updated_at, path, size and sha256, ordered by name
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, name, updated_at, path, size, sha256 FROM files ORDER BY name"
+            ).fetchall()
+        return [dict(zip(('id', 'name', 'updated_at', 'path', 'size', 'sha256'), row)) for row in rows]
@@ -0,0 +1,93 @@
+"""
+Compact records of the fields a script actually uses
+
+A list of full API dictionaries keeps every key, value and the hash table of each item in memory.
+`record_type` builds a class with `__slots__` for the given fields instead; its `from_dict`
+projects a decoded item onto them, and the rest of the item is freed with the page it came from:
+
+    Invoice = record_type('Invoice', ('id', 'no', 'toPay'))
+    for invoice in iter_pages(client, "/finance/invoices", record=Invoice):
+        invoice.toPay, invoice['toPay']
+
+Values of the `shared` fields are interned, so e.g. the buyer name or the deadline repeated by
+thousands of invoices is stored once. Records can be read like the dictionaries they replace
+(`record[key]`, `record.get(key)`), so column specs (see icp.columns) work on both, and they can
+be pickled when the class is defined at module level.
+"""
+import keyword
+import sys
+
+
+def share(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+def _compile(source, name, namespace):
+    exec(compile(source, f"<{name}>", "exec"), namespace)
+    return namespace[name]
+
+
+class Record:
+    """
+    Base class of the record types, see `record_type`
+    """
+    __slots__ = ()
+    fields = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.fields)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{f}={getattr(self, f)!r}' for f in self.fields)})"
+
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in self.fields)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.fields, state):
+            setattr(self, field, value)
+
+
+def record_type(name, fields, shared=(), module=None):
+    """
+    :param name: Class name
+    :param fields: Keys of the API item kept in the record, they must be valid identifiers
+    :param shared: Fields whose string values repeat between records and are interned
+    :param module: Module the class is defined in (for pickling), by default the calling one
+    :return: `Record` subclass with a slot per field and a `from_dict(item)` class method
+    """
+    fields = tuple(fields)
+    for field in fields:
+        if not field.isidentifier() or keyword.iskeyword(field) or field == 'self':
+            raise ValueError(f"{field!r} is not a valid record field")
+
+    # the constructor and the projection are generated, so building a record does not loop over the fields
+    arguments = ", ".join(f"{field}=None" for field in fields)
+    assignments = "".join(f"\n    self.{field} = {field}" for field in fields) or "\n    pass"
+    __init__ = _compile(f"def __init__(self, {arguments}):{assignments}\n", "__init__", {})
+    values = ", ".join(f"share(get({field!r}))" if field in shared else f"get({field!r})" for field in fields)
+    from_dict = _compile(f"def from_dict(cls, item):\n    get = item.get\n    return cls({values})\n",
+                         "from_dict", {'share': share})
+
+    cls = type(name, (Record,), {
+        '__slots__': fields,
+        'fields': fields,
+        '__init__': __init__,
+        'from_dict': classmethod(from_dict),
+    })
+    cls.__module__ = module or sys._getframe(1).f_globals.get('__name__', '__main__')
+    return cls
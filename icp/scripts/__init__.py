@@ -0,0 +1,62 @@
+"""
+The example scripts as importable modules, e.g. `icp.scripts.multi_export`
+
+The scripts live in directories whose names are not valid module names, so a finder maps the
+modules of this package to their files. Importing a script by name (instead of loading it from
+its path) lets worker processes started with `spawn` or `forkserver` unpickle its functions
+and records, they simply import the same module again.
+
+Scripts are found in the repository when the package is used from a checkout (or an editable
+install), and in `icp/scripts/files/<module>` where `pip install .` ships them otherwise.
+"""
+import importlib.abc
+import importlib.util
+import sys
+from os.path import join, dirname, abspath, basename, exists
+
+ROOT = abspath(join(dirname(__file__), '..', '..'))
+
+# module name -> script relative to the repository root, pyproject.toml ships the same directories
+SCRIPTS = {
+    'download_invoices': 'python-download-all-invoices/main.py',
+    'export_projects': 'python-export-projects-to-csv/export-projects-to-csv.py',
+    'unpaid_report': 'python-export-unpaid-invoices-to-cashcollector-xls/main.py',
+    'apilo_orders': 'python-export-orders-from-apilo-to-icp-tasks/export-orders-from-apilo-to-icp-tasks.py',
+    'import_contractors': 'python-import-contractors-from-csv/import-contractors-from-csv.py',
+    'import_costs': 'python-import-costs-from-csv/import-costs-from-csv.py',
+    'import_projects': 'python-import-projects-from-csv/import-projects-from-csv.py',
+    'import_users': 'python-import-users-from-csv/import-users-from-csv.py',
+    'multi_export': 'python-multi-instance-export/multi-instance-export.py',
+}
+
+
+def script_path(name):
+    """
+    :param name: Module name of a script, e.g. `import_costs`
+    :return: Path of the script file
+    :raise FileNotFoundError: The script is neither in the repository nor installed with the package
+    """
+    path = join(ROOT, SCRIPTS[name])
+    if exists(path):
+        return path
+    installed = join(dirname(__file__), 'files', name, basename(SCRIPTS[name]))
+    if exists(installed):
+        return installed
+    raise FileNotFoundError(f"{SCRIPTS[name]} is missing, install the package with `pip install .` "
+                            f"or run the icp command from a checkout of the repository")
+
+
+class ScriptFinder(importlib.abc.MetaPathFinder):
+    """
+    Finds `icp.scripts.<name>` in the script file of `name`
+    """
+
+    def find_spec(self, fullname, path, target=None):
+        package, _, name = fullname.rpartition('.')
+        if package != __name__ or name not in SCRIPTS:
+            return None
+        return importlib.util.spec_from_file_location(fullname, script_path(name))
+
+
+if not any(isinstance(finder, ScriptFinder) for finder in sys.meta_path):
+    sys.meta_path.append(ScriptFinder())
@@ -0,0 +1,59 @@
+"""
+Persisted state of incremental syncs, stored in a local SQLite file
+
+A sync keeps named high-water marks (e.g. the newest processed `createdAt`) and a mapping of
+source ids to the ids of the entities created from them, so a rerun neither re-fetches old
+data nor creates duplicates.
+"""
+import sqlite3
+import threading
+
+
+class SyncState:
+    """
+    Marks and source id -> target id mapping of a sync, safe to share between threads
+    """
+
+    def __init__(self, path):
+        """
+        :param path: SQLite file, created when missing
+        """
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS marks (name TEXT PRIMARY KEY, value TEXT)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS mapping (source_id TEXT PRIMARY KEY, target_id TEXT)")
+
+    def get_mark(self, name, default=None):
+        """
+        :param name: Name of the mark
+        :param default: Returned when the mark was never set
+        :return: Stored value
+        """
+        with self.lock:
+            row = self.db.execute("SELECT value FROM marks WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def set_mark(self, name, value):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO marks (name, value) VALUES (?, ?)", (name, value))
+
+    def get_target(self, source_id):
+        """
+        :param source_id: Id in the source system
+        :return: Id of the entity created from it, or None when not synced yet
+        """
+        with self.lock:
+            row = self.db.execute("SELECT target_id FROM mapping WHERE source_id = ?", (str(source_id),)).fetchone()
+        return row[0] if row else None
+
+    def record(self, source_id, target_id):
+        """
+        Stores the id of the entity created from `source_id`, committed immediately
+        """
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO mapping (source_id, target_id) VALUES (?, ?)",
+                            (str(source_id), str(target_id)))
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,233 @@
+"""
+Per-request HTTP telemetry for the pooled sessions
+
+A response hook records endpoint template, status, bytes sent and received, latency and retry count
+of every outbound request, aggregates them into counters and latency histograms and writes them at
+exit as JSON or Prometheus text format. Enabled with environment variables:
+
+    ICP_METRICS_FILE=metrics.prom   # aggregated metrics, Prometheus format for .prom/.txt, JSON otherwise
+    ICP_TRACE_FILE=trace.jsonl      # optional, one JSON line per request
+
+Worker processes started by multiprocessing (e.g. by multi-instance-export.py) write files of their
+own next to these, named with their pid (`metrics.<pid>.prom`), instead of overwriting the ones of
+the main process.
+"""
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+INSTANCE_PREFIX = re.compile(r'^/api/instance/[^/]*')
+
+# path segments holding ids (anything with a digit: uuids, numbers, invoice numbers...)
+ID_SEGMENT = re.compile(r'^[^/]*\d[^/]*$')
+
+
+def endpoint_template(url):
+    """
+    Turns a request url into a low-cardinality endpoint name
+
+    `https://app.icproject.com/api/instance/slug/finance/invoices/3fa8.../download-file`
+    becomes `/finance/invoices/{id}/download-file`.
+    """
+    path = INSTANCE_PREFIX.sub('', urlsplit(url).path)
+    return '/'.join('{id}' if ID_SEGMENT.match(segment) else segment for segment in path.split('/')) or '/'
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile
+        """
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return 0.0
+
+
+class Telemetry:
+    """
+    Thread-safe collector of request metrics
+    """
+
+    def __init__(self, trace_path=None):
+        """
+        :param trace_path: Optional file receiving one JSON line per request
+        """
+        self.lock = threading.Lock()
+        self.requests = {}  # (method, endpoint, status) -> count
+        self.latency = {}  # (method, endpoint) -> Histogram
+        self.bytes_out = {}  # (method, endpoint) -> bytes
+        self.bytes_in = {}  # (method, endpoint) -> bytes
+        self.retries = {}  # (method, endpoint) -> retries
+        self.trace = open(trace_path, 'a', encoding='utf-8') if trace_path else None
+
+    def record(self, method, endpoint, status, latency, bytes_out=0, bytes_in=0, retries=0):
+        key = (method, endpoint)
+        with self.lock:
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            self.latency.setdefault(key, Histogram()).observe(latency)
+            self.bytes_out[key] = self.bytes_out.get(key, 0) + bytes_out
+            self.bytes_in[key] = self.bytes_in.get(key, 0) + bytes_in
+            self.retries[key] = self.retries.get(key, 0) + retries
+            if self.trace:
+                self.trace.write(json.dumps({
+                    "time": time.time(), "method": method, "endpoint": endpoint, "status": status,
+                    "latency": round(latency, 6), "bytes_out": bytes_out, "bytes_in": bytes_in, "retries": retries,
+                }) + "\n")
+
+    def hook(self, response, *args, **kwargs):
+        """
+        `requests` response hook, see `install`
+        """
+        request = response.request
+        body = request.body or b''
+        raw = getattr(response, 'raw', None)
+        retries = getattr(raw, 'retries', None)
+        # urllib3 retries plus the throttled requests retried by icp.governor.GovernedAdapter
+        retries = (len(retries.history) if retries is not None else 0) + getattr(response, 'governor_retries', 0)
+        self.record(
+            request.method,
+            endpoint_template(request.url),
+            response.status_code,
+            response.elapsed.total_seconds(),
+            bytes_out=len(body),
+            # the body is not read yet when hooks run, streamed downloads included
+            bytes_in=int(response.headers.get('Content-Length') or 0),
+            retries=retries,
+        )
+
+    def install(self, session):
+        """
+        Records every request sent by `session`
+        """
+        session.hooks['response'].append(self.hook)
+
+    def to_json(self):
+        with self.lock:
+            endpoints = []
+            for key, histogram in sorted(self.latency.items()):
+                endpoints.append({
+                    "method": key[0],
+                    "endpoint": key[1],
+                    "requests": histogram.count,
+                    "statuses": {str(s): n for (m, e, s), n in sorted(self.requests.items()) if (m, e) == key},
+                    "bytes_out": self.bytes_out[key],
+                    "bytes_in": self.bytes_in[key],
+                    "retries": self.retries[key],
+                    "latency_seconds": {
+                        "sum": round(histogram.sum, 6),
+                        "p50": histogram.quantile(0.5),
+                        "p99": histogram.quantile(0.99),
+                        "buckets": {str(b): c for b, c in zip(LATENCY_BUCKETS, histogram.counts)},
+                    },
+                })
+        return json.dumps({"endpoints": endpoints}, indent=2)
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            lines.append("# HELP icp_http_requests_total Outbound HTTP requests")
+            lines.append("# TYPE icp_http_requests_total counter")
+            for (method, endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f'icp_http_requests_total{{{labels(method, endpoint)},status="{status}"}} {count}')
+
+            lines.append("# HELP icp_http_request_duration_seconds Latency of outbound HTTP requests")
+            lines.append("# TYPE icp_http_request_duration_seconds histogram")
+            for (method, endpoint), histogram in sorted(self.latency.items()):
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float('inf') else bound
+                    lines.append(f'icp_http_request_duration_seconds_bucket{{{labels(method, endpoint)},le="{le}"}} '
+                                 f'{cumulative}')
+                lines.append(f'icp_http_request_duration_seconds_sum{{{labels(method, endpoint)}}} {histogram.sum}')
+                lines.append(f'icp_http_request_duration_seconds_count{{{labels(method, endpoint)}}} {histogram.count}')
+
+            for name, values, help_text in (
+                ("icp_http_request_bytes_total", self.bytes_out, "Bytes sent in request bodies"),
+                ("icp_http_response_bytes_total", self.bytes_in, "Bytes received in response bodies"),
+                ("icp_http_retries_total", self.retries, "Retried outbound HTTP requests"),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for (method, endpoint), value in sorted(values.items()):
+                    lines.append(f'{name}{{{labels(method, endpoint)}}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Writes the aggregated metrics, Prometheus text format for .prom/.txt files, JSON otherwise
+        """
+        content = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    def close(self):
+        if self.trace:
+            self.trace.close()
+            self.trace = None
+
+
+def labels(method, endpoint):
+    return f'method="{method}",endpoint="{endpoint}"'
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def process_path(path):
+    """
+    :return: `path` in the main process, `path` with the pid before the extension in a worker process
+    """
+    import multiprocessing
+    if multiprocessing.parent_process() is None:
+        return path
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.{os.getpid()}{extension}"
+
+
+def get_default():
+    """
+    Process-wide `Telemetry` configured from ICP_METRICS_FILE / ICP_TRACE_FILE, or None when both are unset
+
+    The metrics are written to ICP_METRICS_FILE when the interpreter exits, see `process_path` for worker processes.
+    """
+    global _default
+    metrics_path = os.environ.get("ICP_METRICS_FILE")
+    trace_path = os.environ.get("ICP_TRACE_FILE")
+    if not metrics_path and not trace_path:
+        return None
+
+    with _default_lock:
+        if _default is None:
+            _default = Telemetry(trace_path and process_path(trace_path))
+            if metrics_path:
+                atexit.register(_default.dump, process_path(metrics_path))
+            atexit.register(_default.close)
+    return _default
@@ -0,0 +1,173 @@
+"""
+Pre-flight validation of the CSV files read by the importers
+
+The whole file is checked in one streaming pass before any request is sent, so a malformed row
+near the end of a large file does not abort the import after hours of API calls. A schema is a
+tuple of `(column, kind, required)` or `(column, kind, required, choices)` entries:
+
+- `kind` is one of "text", "number", "integer", "bool", "date", "datetime", "email" or "uuid",
+- `required` is True when the value may not be empty, False when the column must exist but may
+  be empty, None when the column itself is optional,
+- `choices` lists the allowed values of an enum column.
+
+Errors are reported with the row number (1-based, header excluded), the line in the file, the
+column and the offending value, and written as JSON for other tools.
+"""
+import csv
+import json
+import math
+import re
+import uuid
+from datetime import date, datetime
+
+# errors kept in the report, the rest are only counted
+DEFAULT_MAX_ERRORS = 1000
+
+EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+def check_number(value):
+    if not math.isfinite(float(value)):
+        raise ValueError("not a finite number")
+
+
+def check_bool(value):
+    if value.lower() not in ('true', 'false'):
+        raise ValueError("expected true or false")
+
+
+def check_datetime(value):
+    datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+
+
+def check_email(value):
+    if not EMAIL.match(value):
+        raise ValueError("not an email address")
+
+
+# kind -> function raising ValueError for an invalid non-empty value
+CHECKS = {
+    'text': None,
+    'number': check_number,
+    'integer': int,
+    'bool': check_bool,
+    'date': date.fromisoformat,
+    'datetime': check_datetime,
+    'email': check_email,
+    'uuid': uuid.UUID,
+}
+
+
+class ValidationReport:
+    """
+    Errors found by `validate_csv`
+    """
+
+    def __init__(self, path, max_errors=DEFAULT_MAX_ERRORS):
+        self.path = path
+        self.max_errors = max_errors
+        self.rows = 0
+        self.error_count = 0
+        self.errors = []
+
+    @property
+    def ok(self):
+        return self.error_count == 0
+
+    def add(self, row, line, column, value, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row, "line": line, "column": column, "value": value, "error": message})
+
+    def to_dict(self):
+        return {
+            "file": self.path,
+            "rows": self.rows,
+            "valid": self.ok,
+            "error_count": self.error_count,
+            "truncated": self.error_count > len(self.errors),
+            "errors": self.errors,
+        }
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2, ensure_ascii=False)
+
+    def print(self, limit=20):
+        print(f"Validation of {self.path}: {self.rows} rows, {self.error_count} errors.")
+        for error in self.errors[:limit]:
+            column = f", {error['column']}" if error['column'] else ""
+            print(f"  row {error['row']} (line {error['line']}{column}): {error['error']}")
+        if self.error_count > limit:
+            print(f"  ... and {self.error_count - limit} more")
+
+
+def validate_csv(path, schema, max_errors=DEFAULT_MAX_ERRORS, delimiter=','):
+    """
+    Checks the header and every row of a CSV file against a schema
+
+    :param path: CSV file with a header row
+    :param schema: Tuple of (column, kind, required[, choices]) entries
+    :param max_errors: Errors kept in the report
+    :param delimiter: CSV delimiter
+    :return: `ValidationReport`
+    """
+    report = ValidationReport(path, max_errors)
+    # utf-8-sig drops the BOM Excel puts before the first column name, like icp.journal.read_csv does
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            report.add(0, 1, None, None, "empty file")
+            return report
+
+        # checks of the columns present in the file, resolved once
+        checks = []
+        for column, kind, required, *choices in schema:
+            if column not in header:
+                if required is not None:
+                    report.add(0, 1, column, None, "missing column")
+                continue
+            choices = frozenset(choices[0]) if choices else None
+            checks.append((header.index(column), column, CHECKS[kind], required, choices))
+
+        for number, row in enumerate(reader, start=1):
+            report.rows = number
+            if len(row) != len(header):
+                report.add(number, reader.line_num, None, None, f"expected {len(header)} fields, found {len(row)}")
+                continue
+            for index, column, check, required, choices in checks:
+                value = row[index]
+                if not value:
+                    if required:
+                        report.add(number, reader.line_num, column, value, "value is required")
+                    continue
+                if choices is not None and value not in choices:
+                    report.add(number, reader.line_num, column, value, f"expected one of {', '.join(sorted(choices))}")
+                elif check is not None:
+                    try:
+                        check(value)
+                    except ValueError as e:
+                        report.add(number, reader.line_num, column, value, str(e))
+    return report
+
+
+def preflight(path, schema, report_path=None, **kwargs):
+    """
+    Validates a CSV file before an import, prints the errors and writes them as JSON
+
+    :param path: CSV file
+    :param schema: See `validate_csv`
+    :param report_path: JSON report written when the file is invalid, by default `<path>.errors.json`
+    :param kwargs: Passed through to `validate_csv`
+    :return: True when the file is valid
+    """
+    report = validate_csv(path, schema, **kwargs)
+    if report.ok:
+        return True
+
+    report_path = report_path or f"{path}.errors.json"
+    report.print()
+    report.write(report_path)
+    print(f"Nothing was imported, the full report is in {report_path}")
+    return False
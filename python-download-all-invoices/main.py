@@ -1,87 +1,269 @@
+import hashlib
+import heapq
+import itertools
 import os
+import queue
 import sys
+import threading
+import time
 from os.path import join, dirname
-import requests
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Iterator
+
+sys.path.insert(0, join(dirname(__file__), '..'))  # shared helpers in ../icp
+from icp import IcpClient, iter_pages
+from icp.manifest import FileManifest
+from icp.pagination import DEFAULT_PREFETCH
+from icp.records import record_type
 
 load_dotenv(join(dirname(__file__), '.env'))
 
 icp_authorization_token = os.environ.get("ICP_AUTHORIZATION_TOKEN")
 icp_instance_slug = os.environ.get("ICP_INSTANCE_SLUG")
 
-headers = {
-    'X-Auth-Token': icp_authorization_token,
-    'Accept': 'application/json',
-    'Content-type': 'application/json'
-}
+# number of invoices downloaded in parallel, 1 downloads them one by one
+download_workers = int(os.environ.get("DOWNLOAD_WORKERS") or 8)
+
+# seconds to wait for PDFs generated during this run, 0 only requests the generation (run the script again later)
+pdf_generation_timeout = int(os.environ.get("PDF_GENERATION_TIMEOUT") or 600)
+
+# seconds between checks of a PDF being generated, doubled after every check up to the maximum
+pdf_poll_interval = 1
+pdf_poll_max_interval = 30
+
+download_dir = "faktury"
+
+# index of the downloaded invoices (id -> number, updatedAt, size, checksum) and the last sync mark
+manifest_path = join(download_dir, ".manifest.sqlite3")
 
-icp_api_url = f"https://app.icproject.com/api/instance/{icp_instance_slug}"
+# invoices updated this long before the last sync are listed again, covers changes made while it was running
+manifest_overlap = timedelta(hours=1)
 
+client = IcpClient(icp_instance_slug, icp_authorization_token, pool_size=max(download_workers, DEFAULT_PREFETCH))
 
+# listed invoices keep only the fields needed to download them, and only these are requested from the API
+Invoice = record_type('Invoice', ('id', 'no', 'updatedAt', 'fileGenerated'))
+sparse_fieldsets = True
 
-def retrieve_invoices_list() -> list:
-    page = 1
-    per_page = 100
+manifest = None
+
+# set when any invoice could not be downloaded, the sync mark is then kept for the next run
+incomplete = threading.Event()
+
+
+
+def retrieve_invoices_list(updated_after: str = None) -> Iterator[Invoice]:
     date_start = datetime.today().replace(day=1).replace(month=1).replace(hour=0, minute=0, second=0, microsecond=0)
     date_end = datetime.today().replace(day=31).replace(month=12)
-    items = []
-    while True:
-        print(f"Retrieving invoices, page: {page}")
-        response = requests.get(
-            f"{icp_api_url}/finance/invoices",
-            params={
-                "page": page,
-                "itemsPerPage": per_page,
-                "dateIssue[after]": date_start.isoformat(),
-                "dateIssue[before]": date_end.isoformat(),
-                "order[number]": "asc"
-            },
-            headers=headers,
-            timeout=10
-        )
 
-        items += response.json()
+    params = {
+        "dateIssue[after]": date_start.isoformat(),
+        "dateIssue[before]": date_end.isoformat(),
+        "order[number]": "asc"
+    }
+    if updated_after:
+        # only invoices changed since the last sync
+        params["updatedAt[after]"] = updated_after
 
-        if len(response.json()) < per_page:
-            break
+    # pages are requested a few at a time ahead of the consumer
+    return iter_pages(client, "/finance/invoices", params=params, record=Invoice,
+                      properties=Invoice.fields if sparse_fieldsets else None)
 
-        page = page + 1
 
-    return items
+def file_sha256(fn) -> str:
+    digest = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
+def download_invoice(item) -> str:
+    """
+    Downloads the PDF of a single invoice, safe to run from several threads at once
 
-if __name__ == '__main__':
+    :param item: Invoice from the invoices list, with a generated PDF
+    :return: Status message
+    """
+    fn = join(download_dir, f"{item['no'].replace('/', '-')}.pdf")
+    updated_at = item.get('updatedAt')
+    entry = manifest.get(item['id'])
+
+    if entry is None and os.path.exists(fn):
+        # downloaded before the manifest existed
+        manifest.put(item['id'], item['no'], updated_at, fn, os.path.getsize(fn), file_sha256(fn))
+        return "file already exists"
+
+    if entry and os.path.exists(entry['path']) and not is_modified(updated_at, entry['updated_at']):
+        return "file already exists"
+
+    res = client.get(f"/finance/invoices/{item['id']}/download-file")
+    res.raise_for_status()
+    download_url = res.json()['downloadUrl']
+
+    # streamed to a temporary file in chunks and renamed when complete
+    digest = hashlib.sha256()
+    client.download(download_url, fn, digest=digest)
+
+    if entry and entry['path'] != fn and os.path.exists(entry['path']):
+        # the invoice number changed
+        os.remove(entry['path'])
+    manifest.put(item['id'], item['no'], updated_at, fn, os.path.getsize(fn), digest.hexdigest())
+    return "updated" if entry else "done"
+
+
+def is_modified(updated_at, downloaded_updated_at) -> bool:
+    if not updated_at or not downloaded_updated_at:
+        return False
+    return datetime.fromisoformat(updated_at) > datetime.fromisoformat(downloaded_updated_at)
+
+
+def run_download(item):
+    try:
+        print(f"Downloading {item['no']} {download_invoice(item)}")
+    except Exception as e:
+        incomplete.set()
+        print(f"Downloading {item['no']} failed: {e}")
+
+
+def generate_pdf(item):
+    client.patch(f"/finance/invoices/{item['id']}/generate-pdf").raise_for_status()
+
+
+def on_generation_requested(item, future, pending: queue.Queue):
+    if future.cancelled():
+        # the run is ending on an error
+        incomplete.set()
+    elif future.exception():
+        incomplete.set()
+        print(f"Generating {item['no']} failed: {future.exception()}")
+    elif pdf_generation_timeout:
+        pending.put(item)
+    else:
+        incomplete.set()
+        print(f"Downloading {item['no']} file is not generated, try to run script once again")
 
+
+def is_pdf_generated(item) -> bool:
     try:
-        items = retrieve_invoices_list()
+        res = client.get(f"/finance/invoices/{item['id']}")
+        res.raise_for_status()
+        return bool(res.json()['fileGenerated'])
     except Exception as e:
-        print(e)
-        sys.exit(1)
+        print(f"Checking {item['no']} failed: {e}")
+        return False
+
+
+def poll_generated_pdfs(pending: queue.Queue, executor, stop: threading.Event):
+    """
+    Background poller of the invoices whose PDF is being generated
+
+    Invoices are read from `pending` (None ends the input) and checked with exponential backoff;
+    each one is submitted to `executor` for download as soon as its PDF is ready.
+
+    :param pending: Queue of invoices whose generation was requested
+    :param executor: Executor running the downloads
+    :param stop: Set to give up the invoices still waiting, put None into `pending` too so the poller wakes up
+    """
+    waiting = []  # heap of (next check, interval, sequence, deadline, invoice)
+    sequence = itertools.count()
+    input_done = False
 
-    for item in items:
-        print(f"Downloading {item['no']}", end=" ")
-        if not item['fileGenerated']:
-            requests.patch(f"{icp_api_url}/finance/invoices/{item['id']}/generate-pdf", headers=headers)
-            print("file is not generated, try to run script once again")
-            continue
+    with ThreadPoolExecutor(max_workers=DEFAULT_PREFETCH) as checker:
+        while (not input_done or waiting) and not stop.is_set():
+            # collect newly triggered invoices until the next check is due
+            timeout = max(0.0, waiting[0][0] - time.monotonic()) if waiting else None
+            try:
+                item = pending.get(timeout=timeout)
+                if item is None:
+                    input_done = True
+                else:
+                    now = time.monotonic()
+                    heapq.heappush(waiting, (now + pdf_poll_interval, pdf_poll_interval, next(sequence),
+                                             now + pdf_generation_timeout, item))
+                continue
+            except queue.Empty:
+                pass
 
-        fn = f"faktury/{item['no'].replace('/', '-')}.pdf"
+            due = []
+            while waiting and waiting[0][0] <= time.monotonic():
+                due.append(heapq.heappop(waiting))
 
-        if os.path.exists(fn):
-            print("file already exists")
-            continue
+            for entry, generated in zip(due, checker.map(is_pdf_generated, [entry[4] for entry in due])):
+                _, interval, seq, deadline, item = entry
+                if generated:
+                    executor.submit(run_download, item)
+                elif time.monotonic() >= deadline:
+                    incomplete.set()
+                    print(f"Downloading {item['no']} file was not generated in {pdf_generation_timeout}s, skipped")
+                else:
+                    interval = min(interval * 2, pdf_poll_max_interval)
+                    heapq.heappush(waiting, (time.monotonic() + interval, interval, seq, deadline, item))
 
-        res = requests.get(f"{icp_api_url}/finance/invoices/{item['id']}/download-file", headers=headers)
-        download_url = res.json()['downloadUrl']
 
-        res = requests.get(download_url)
 
-        with open(fn, 'wb') as f:
-            f.write(res.content)
-        print("done")
+def main() -> int:
+    """
+    Downloads the invoices of the configured instance into `download_dir`
 
+    :return: Exit code, 1 when the invoices list could not be retrieved
+    """
+    global manifest
 
+    os.makedirs(download_dir, exist_ok=True)
 
+    manifest = FileManifest(manifest_path)
+    last_sync = manifest.get_mark('updatedAfter')
+    updated_after = None
+    if last_sync:
+        updated_after = (datetime.fromisoformat(last_sync) - manifest_overlap).isoformat()
+    newest = None
 
+    pending = queue.Queue()
+    stop_polling = threading.Event()
+    generating = []
+
+    try:
+        with ThreadPoolExecutor(max_workers=download_workers) as executor:
+            poller = threading.Thread(target=poll_generated_pdfs, args=(pending, executor, stop_polling), daemon=True)
+            poller.start()
+
+            # downloads start while later pages of the list are still being retrieved,
+            # missing PDFs are generated concurrently and downloaded once the poller sees them ready
+            try:
+                for item in retrieve_invoices_list(updated_after):
+                    if item.get('updatedAt') and (newest is None or is_modified(item['updatedAt'], newest)):
+                        newest = item['updatedAt']
+
+                    if item['fileGenerated']:
+                        executor.submit(run_download, item)
+                        continue
+
+                    future = executor.submit(generate_pdf, item)
+                    future.add_done_callback(lambda f, item=item: on_generation_requested(item, f, pending))
+                    generating.append(future)
+            except Exception as e:
+                print(e)
+                # the poller submits downloads, it is stopped before the executor refuses new ones
+                stop_polling.set()
+                pending.put(None)
+                poller.join()
+                executor.shutdown(cancel_futures=True)
+                return 1
+
+            wait(generating)
+            pending.put(None)
+            poller.join()
+
+        # the next run lists only invoices changed after the newest one seen, unless something failed
+        if newest and not incomplete.is_set():
+            manifest.set_mark('updatedAfter', newest)
+        return 0
+    finally:
+        manifest.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,40 +1,72 @@
+import asyncio
+import os
+import sys
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, dirname
+
 import requests
 
-# Apilo API configuration
-APILO_INSTANCE_SLUG = "YOUR_APILO_INSTANCE_SLUG"  # Slug for your Apilo instance
-APILO_ACCESS_TOKEN  = "YOUR_APILO_ACCESS_TOKEN"
+sys.path.insert(0, join(dirname(__file__), '..'))  # shared helpers in ../icp
+from icp import IcpClient, create_session
+from icp.cache import ttl_cache
+from icp.http_cache import HttpCache
+from icp.sync_state import SyncState
+
+# Apilo API configuration, every value can also be set in the environment variable of the same name
+APILO_INSTANCE_SLUG = os.environ.get("APILO_INSTANCE_SLUG", "YOUR_APILO_INSTANCE_SLUG")  # Slug for your Apilo instance
+APILO_ACCESS_TOKEN = os.environ.get("APILO_ACCESS_TOKEN", "YOUR_APILO_ACCESS_TOKEN")
+APILO_API_URL = os.environ.get("APILO_API_URL", f"https://{APILO_INSTANCE_SLUG}.apilo.com")
+
+# IC Project API configuration, also read from ICP_INSTANCE_SLUG, ICP_AUTHORIZATION_TOKEN and ICP_BOARD_LINK
+IC_PROJECT_INSTANCE_SLUG = os.environ.get("ICP_INSTANCE_SLUG", "YOUR_IC_PROJECT_INSTANCE_SLUG")  # Instance slug
+IC_PROJECT_API_KEY = os.environ.get("ICP_AUTHORIZATION_TOKEN", "YOUR_IC_PROJECT_API_KEY")  # API key for IC Project
+IC_PROJECT_BOARD_LINK = os.environ.get("ICP_BOARD_LINK", "YOUR_IC_PROJECT_BOARD_LINK")  # Link to the project board
+
+# Board columns and task templates rarely change, they are fetched once and reused for this many seconds
+LOOKUP_CACHE_TTL = 15 * 60
+
+# Sync state: the newest processed order creation date and the order ID -> task ID mapping
+SYNC_STATE_PATH = os.environ.get("APILO_SYNC_STATE_PATH", join(dirname(__file__), 'apilo-sync-state.sqlite3'))
+INITIAL_CREATED_AFTER = "2022-03-01T14:40:33+0200"  # Orders created before this date are never synced
 
-# IC Project API configuration
-IC_PROJECT_INSTANCE_SLUG = "YOUR_IC_PROJECT_INSTANCE_SLUG"  # Slug for IC Project instance
-IC_PROJECT_API_KEY = "YOUR_IC_PROJECT_API_KEY"  # API key for IC Project
-IC_PROJECT_BOARD_LINK = "YOUR_IC_PROJECT_BOARD_LINK"  # Link to the project board
+# Orders are paged through with offset/limit while tasks are already being created from the previous pages.
+# At most ORDER_QUEUE_SIZE fetched orders wait for a task, the pages are not fetched further ahead than that.
+ORDERS_PAGE_SIZE = 256  # Apilo accepts up to 512
+ORDER_QUEUE_SIZE = 512
+TASK_WORKERS = 8  # tasks created concurrently
 
-# Function to retrieve orders from Apilo
-def get_orders_from_apilo():
+# Namespace of the task identifiers derived from Apilo order IDs
+TASK_IDENTIFIER_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, f"https://{APILO_INSTANCE_SLUG}.apilo.com/rest/api/orders")
+
+# Pooled clients, connections are kept alive between requests
+# Boards, board columns and task templates are cached on disk between runs and revalidated when stale
+icp_client = IcpClient(IC_PROJECT_INSTANCE_SLUG, IC_PROJECT_API_KEY, cache=HttpCache())
+apilo_session = create_session(headers={
+    'Accept': 'application/json',
+    'Content-Type': 'application/json',
+    # Authorization token for Apilo stored in APILO_ACCESS_TOKEN
+    'Authorization': f"Bearer {APILO_ACCESS_TOKEN}",
+})
+
+# Function to retrieve a page of orders from Apilo
+def get_orders_from_apilo(created_after, offset=0, limit=ORDERS_PAGE_SIZE):
     """
-    Retrieves orders from Apilo
+    Retrieves a page of orders from Apilo, the oldest first
 
+    :param created_after: Only orders created after this date are returned
+    :param offset: Number of orders to skip
+    :param limit: Number of orders in the page
     :return: Orders in JSON format
+    :raise requests.RequestException: The page could not be fetched, also after the retries of the session
     """
-    # url = f"https://{APILO_INSTANCE_SLUG}.apilo.com/rest/api/orders"
-    # You can add eventual filters to the URL or use the non-filtered URL
-    url = f"https://{APILO_INSTANCE_SLUG}.apilo.com/rest/api/orders&createdAfter=2022-03-01T14%3A40%3A33%2B0200"
-    headers = {
-        'Accept': 'application/json',
-        'Content-Type': 'application/json',
-        # Authorization token for Apilo stored in APILO_ACCESS_TOKEN
-        'Authorization': f"Bearer {APILO_ACCESS_TOKEN}",
-    }
-    try:
-        # Send GET request to fetch orders from Apilo
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        return response.json()
-    except requests.RequestException as e:
-        # Handle error if the request fails
-        print(f"Error fetching orders: {e}")
-        return {}
+    url = f"{APILO_API_URL}/rest/api/orders"
+    # You can add eventual filters to the params
+    params = {'createdAfter': created_after, 'sort': 'createdAtAsc', 'offset': offset, 'limit': limit}
+    # Send GET request to fetch orders from Apilo, an empty result would end the sync as if all orders were read
+    response = apilo_session.get(url, params=params)
+    response.raise_for_status()  # Raise an exception for HTTP errors
+    return response.json()
 
 # Function to extract the board slug from the board URL
 def get_board_slug(url):
@@ -48,22 +80,18 @@ def get_board_slug(url):
     return parts[-1]
 
 # Function to get the first column's ID of the board
+@ttl_cache(LOOKUP_CACHE_TTL)
 def get_board_column_id(board_slug):
     """
     Retrieves the ID of the first column of the board based on the given board slug
 
+    The result is memoized for LOOKUP_CACHE_TTL seconds, so the board is looked up once, not per order.
+
     :param board_slug: Board slug
     :return: The ID of the first board column
     """
-    url = f"https://app.icproject.com/api/instance/{IC_PROJECT_INSTANCE_SLUG}/project/boards/s/{board_slug}/get-kanban-board"
-    headers = {
-        'X-Auth-Token': IC_PROJECT_API_KEY,
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-    }
-
     try:
-        response = requests.get(url, headers=headers)
+        response = icp_client.get(f"/project/boards/s/{board_slug}/get-kanban-board")
         response.raise_for_status()  # Raise an exception for HTTP errors
         board_id = response.json().get('id')  # Get the board ID
         if not board_id:
@@ -75,9 +103,8 @@ def get_board_column_id(board_slug):
         print(e)
         return None
 
-    url = f"https://app.icproject.com/api/instance/{IC_PROJECT_INSTANCE_SLUG}/project/boards/{board_id}/board-columns"
     try:
-        response = requests.get(url, headers=headers)
+        response = icp_client.get(f"/project/boards/{board_id}/board-columns")
         response.raise_for_status()  # Raise an exception for HTTP errors
         # Assuming the first column's ID is needed
         return response.json()[0].get('id')
@@ -85,43 +112,54 @@ def get_board_column_id(board_slug):
         print(f"Error fetching board columns: {e}")
         return None
 
-# Function to create a task in IC Project based on Apilo order
-def create_task_in_ic_project(order):
+# Function to get the task templates of the instance
+@ttl_cache(LOOKUP_CACHE_TTL)
+def get_task_templates():
     """
-    Creates a task in IC Project based on Apilo order data
+    Retrieves the task templates, memoized for LOOKUP_CACHE_TTL seconds
 
-    :param order: Apilo order data
-    :return: None
+    :return: Task templates or None on error
     """
-    url = f"https://app.icproject.com/api/instance/{IC_PROJECT_INSTANCE_SLUG}/project/task-templates"
-    headers = {
-        'X-Auth-Token': IC_PROJECT_API_KEY,
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-    }
-
     try:
-        response = requests.get(url, headers=headers)
+        response = icp_client.get("/project/task-templates")
         response.raise_for_status()  # Raise an exception for HTTP errors
+        return response.json()
     except requests.RequestException as e:
         print(f"Error fetching task templates: {e}")
-        return
+        return None
+
+# Function to derive the task identifier from the Apilo order ID
+def get_task_identifier(order):
+    """
+    Derives a deterministic task identifier from the Apilo order ID
+
+    :param order: Apilo order data
+    :return: UUID string, the same for every run
+    """
+    return str(uuid.uuid5(TASK_IDENTIFIER_NAMESPACE, str(order['id'])))
+
+# Function to create a task in IC Project based on Apilo order
+def create_task_in_ic_project(order):
+    """
+    Creates a task in IC Project based on Apilo order data
+
+    Lookups are cached, so apart from the first order this sends a single POST request.
+
+    :param order: Apilo order data
+    :return: ID of the created task or None on error
+    """
+    if get_task_templates() is None:
+        return None
 
     board_slug = get_board_slug(IC_PROJECT_BOARD_LINK)  # Extract board slug
     column_id = get_board_column_id(board_slug)  # Fetch the column ID of the board
     if not column_id:
         print(f"Error: Unable to find column for board_slug {board_slug}")
-        return
-
-    url = f"https://app.icproject.com/api/instance/{IC_PROJECT_INSTANCE_SLUG}/project/tasks"
-    headers = {
-        'X-Auth-Token': IC_PROJECT_API_KEY,
-        'Accept': 'application/json',
-    }
+        return None
 
     # Create task data based on the order details
     task_data = {
-        "identifier": str(uuid.uuid4()),  # Generate unique task identifier
+        "identifier": get_task_identifier(order),  # Same order always gets the same identifier
         "boardColumn": column_id,  # Assign the task to the specified column
         "name": f"Order ID: {order['idExternal']}",  # Task name is based on external order ID
         "description": f"Order from customer: {order['addressCustomer']['name']}",  # Task description with customer details
@@ -132,28 +170,157 @@ def create_task_in_ic_project(order):
 
     try:
         # Send POST request to create a new task
-        response = requests.post(url, json=task_data, headers=headers)
+        response = icp_client.post("/project/tasks", json=task_data)
         response.raise_for_status()  # Raise an exception for HTTP errors
         if response.status_code == 201:
             print(f"Task for order {order['idExternal']} created successfully.")
+            return response.json().get('id')
         else:
             print(f"Error creating task for order {order['idExternal']}: {response.status_code}")
             print(response.json())
     except requests.RequestException as e:
         print(f"Error creating task: {e}")
+    return None
+
+# Function to follow which orders are done and advance the high-water mark
+class OrderMark:
+    """
+    Advances the 'createdAfter' mark over the orders completed without gaps
+
+    Orders are numbered in the order they were fetched (oldest first) and may complete in any order.
+    The mark stops for good at the first failed order, so it and everything after it is retried by the next run.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.next = 0  # number of the oldest order not completed yet
+        self.completed = {}  # number -> (createdAt, success) of orders completed ahead of it
+        self.failed = False
+        self.value = None  # createdAt of the newest order completed without gaps
+
+    def complete(self, number, created_at, success):
+        """
+        :return: The mark advanced and should be saved, see `save`
+        """
+        if self.failed:
+            return False
+        self.completed[number] = (created_at, success)
+        mark = None
+        while self.next in self.completed:
+            created_at, success = self.completed.pop(self.next)
+            if not success:
+                self.failed = True
+                self.completed.clear()
+                break
+            mark = created_at
+            self.next += 1
+        if mark is None:
+            return False
+        self.value = mark
+        return True
+
+    def save(self):
+        # the value is read when the save runs, so saves finishing out of order still store the newest mark
+        self.state.set_mark('createdAfter', self.value)
+
+
+# Producer: pages through the orders and feeds the queue
+async def produce_orders(created_after, queue, workers):
+    """
+    Puts (number, order) pairs into the queue, followed by one None per consumer
+
+    Waits whenever the queue is full, so pages are fetched only as fast as tasks are created.
+    """
+    number = 0
+    try:
+        while True:
+            page = await asyncio.to_thread(get_orders_from_apilo, created_after, number)
+            orders = page.get('orders', [])
+            for order in orders:
+                await queue.put((number, order))
+                number += 1
+            # Apilo may return fewer orders than requested, the walk ends with an empty page or the total count
+            if not orders or number >= page.get('totalCount', float('inf')):
+                break
+    finally:
+        for _ in range(workers):
+            await queue.put(None)
+
+
+# Function to sync a single order, runs in a worker thread
+def sync_order(state, order):
+    """
+    Creates the task of an order unless the sync state maps it to one already
+
+    :return: ID of the task or None on error
+    """
+    task_id = state.get_target(order['id'])
+    if task_id is None:
+        # Create a task in IC Project for the order
+        task_id = create_task_in_ic_project(order)
+        if task_id is not None:
+            state.record(order['id'], task_id)
+    return task_id
+
+
+# Consumer: creates the tasks of the queued orders
+async def consume_orders(queue, state, mark):
+    while (item := await queue.get()) is not None:
+        number, order = item
+        # the SQLite reads and commits of the sync state run in the thread too, not on the event loop
+        task_id = await asyncio.to_thread(sync_order, state, order)
+        if mark.complete(number, order['createdAt'], task_id is not None):
+            await asyncio.to_thread(mark.save)
+
+
+async def sync_orders(state, workers=TASK_WORKERS, queue_size=ORDER_QUEUE_SIZE):
+    """
+    Runs the producer and `workers` consumers connected by a queue of `queue_size` orders
+
+    :raise requests.RequestException: A page of orders could not be fetched, the orders queued before it are
+        still synced
+    """
+    # blocking HTTP calls run in threads, one per consumer plus one for the producer
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers + 1))
+    created_after = state.get_mark('createdAfter', INITIAL_CREATED_AFTER)
+    queue = asyncio.Queue(maxsize=queue_size)
+    mark = OrderMark(state)
+
+    producer = asyncio.create_task(produce_orders(created_after, queue, workers))
+    # the board column and the templates are looked up once while the first page is downloading
+    await asyncio.to_thread(get_task_templates)
+    await asyncio.to_thread(get_board_column_id, get_board_slug(IC_PROJECT_BOARD_LINK))
+    consumers = [asyncio.create_task(consume_orders(queue, state, mark)) for _ in range(workers)]
+    try:
+        await producer
+    finally:
+        # the producer ends the queue also when it fails, the orders already queued are synced before the error
+        await asyncio.gather(*consumers)
+
 
 # Main function to integrate Apilo orders with IC Project tasks
 def main():
     """
     Main function to integrate Apilo orders with IC Project tasks
 
-    Retrieves orders from Apilo and creates a task for each order in IC Project.
+    Pages through the orders created since the last run in Apilo and creates a task for each order in IC Project,
+    starting while the next pages are still downloading.
+    The creation date of the newest order processed without gaps is stored as the high-water mark of the next run;
+    orders that already have a task are skipped.
+
+    :return: Exit code, 1 when a page of orders could not be fetched
     """
-    orders = get_orders_from_apilo()  # Fetch orders from Apilo
-    for order in orders.get('orders', []):
-        # Create a task in IC Project for each order
-        create_task_in_ic_project(order)
+    state = SyncState(SYNC_STATE_PATH)
+    try:
+        asyncio.run(sync_orders(state))
+    except requests.RequestException as e:
+        # Handle error if the request fails, the next run continues from the stored mark
+        print(f"Error fetching orders: {e}")
+        return 1
+    finally:
+        state.close()
+    return 0
 
 # Run the integration only if the script is being executed directly
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,37 +1,40 @@
 """
 An example of downloading a list of projects from the IC Project API and saving them to a CSV file
 
+The output format follows the file extension: .csv, .csv.gz (gzip-compressed) or .parquet (requires pyarrow).
+
 https://developers.icproject.com/api-documentation/#tag/Project/operation/getProjectCollection
 """
-import csv
+import os
 import sys
+from os.path import join, dirname
 
 import requests
 
+sys.path.insert(0, join(dirname(__file__), '..'))  # shared helpers in ../icp
+from icp import IcpClient, iter_pages
+from icp.columns import compile_columns, write_rows
+from icp.pagination import DEFAULT_PREFETCH
+
 """
 You can find authorization token and instance slug in your instance settings panel.
+They can also be set in the ICP_AUTHORIZATION_TOKEN and ICP_INSTANCE_SLUG environment variables.
 """
-authorization_token = ""
-instance_slug = ""
-
-# necessary headers
-headers = {
-    'X-Auth-Token': authorization_token,
-    'Accept': 'application/json',
-}
-
-# make a request
-response = requests.get(
-    f"https://app.icproject.com/api/instance/{instance_slug}/project/projects?pagination=0",
-    headers=headers,
-)
+authorization_token = os.environ.get("ICP_AUTHORIZATION_TOKEN", "")
+instance_slug = os.environ.get("ICP_INSTANCE_SLUG", "")
+
+# download projects page by page and write each page as soon as it arrives, memory use stays flat
+# set to False to download the whole list in one response (?pagination=0)
+stream_pages = True
+per_page = 100
+
+# destination file, e.g. projects.csv.gz or projects.parquet
+output_file = 'projects.csv'
 
-# check response status code
-if response.status_code != 200:
-    print(response.status_code, response.content)
-    sys.exit()
+# pooled client, sends the necessary headers with every request
+client = IcpClient(instance_slug, authorization_token)
 
-# columns to export, consecutively key, label and optional value formatting function
+# columns to export, consecutively key, label, optional value formatting function and optional Parquet type
 columns = (
     ('id', 'ID', None),
     ('no', 'Number', None),
@@ -45,42 +48,55 @@ columns = (
     ('dateEnd', 'End date', None),
     ('dateStartPlanned', 'Planned start date', None),
     ('dateEndPlanned', 'Planned end date', None),
-    ('isFavorite', 'Favourite?', None),
+    ('isFavorite', 'Favourite?', None, 'bool'),
     ('assignedProjectUsers', 'Assigned users',
      lambda x: ", ".join([u['projectUser']['firstName'] + " " + u['projectUser']['lastName'] for u in x])),
-    ('progress', 'Progress', None),
-    ('budget', 'Budget', None),
-    ('taskCountTotal', 'Total tasks', None),
-    ('taskCountDone', 'Done tasks', None),
-    ('timePlanned', 'Planned time', None),
-    ('timeReported', 'Reported time', None),
+    ('progress', 'Progress', None, 'double'),
+    ('budget', 'Budget', None, 'double'),
+    ('taskCountTotal', 'Total tasks', None, 'int64'),
+    ('taskCountDone', 'Done tasks', None, 'int64'),
+    ('timePlanned', 'Planned time', None, 'int64'),
+    ('timeReported', 'Reported time', None, 'int64'),
     ('shortCode', 'Short code', None),
     ('tags', 'Tags', lambda x: ", ".join([t['name'] for t in x]))
 )
 
-# open file
-with open('projects.csv', 'w', newline='') as csv_file:
-    # csv writer
-    writer = csv.writer(csv_file, delimiter=',', quotechar='"')
+# the columns are compiled once into a single function returning the row of a project
+project_row = compile_columns(columns)
+
+
+def retrieve_projects(prefetch=DEFAULT_PREFETCH):
+    if stream_pages:
+        # pages are requested lazily, while the rows of earlier pages are written
+        return iter_pages(client, "/project/projects", per_page=per_page, prefetch=prefetch)
+
+    # make a request
+    response = client.get("/project/projects", params={"pagination": 0})
+
+    # check response status code
+    if response.status_code != 200:
+        print(response.status_code, response.content)
+        sys.exit(1)
 
-    # header
-    writer.writerow([k[1] for k in columns])
+    return response.json()
 
-    # loop
-    for project in response.json():
-        # some debug
-        print(project['name'])
 
-        row = []
-        for key, label, formatter in columns:
-            value = project[key]
+def main(output=None):
+    output = output or output_file
+    # rows are converted and written in batches, progress is reported once per batch
+    try:
+        count = write_rows(output, columns, retrieve_projects(),
+                           on_batch=lambda count: print(f"{count} projects exported"))
+    except requests.HTTPError as e:
+        # a page requested while streaming failed, reported like a failed request of the whole list
+        print(e.response.status_code, e.response.content)
+        sys.exit(1)
+    except requests.RequestException as e:
+        print(e)
+        sys.exit(1)
+    print(f"Exported {count} projects to {output}")
 
-            # some columns need to be formatted
-            if formatter:
-                value = formatter(value)
 
-            # append value to current row
-            row.append(value)
+if __name__ == '__main__':
+    main()
 
-        # append row to csv
-        writer.writerow(row)
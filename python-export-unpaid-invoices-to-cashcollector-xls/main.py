@@ -1,12 +1,17 @@
+import csv
+import multiprocessing
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 from os.path import join, dirname
-import requests
 from dotenv import load_dotenv
-from dateutil import parser
 from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Iterable, Iterator
 
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill, Alignment, Font
 
 import smtplib
@@ -18,130 +23,163 @@ from email.utils import formatdate
 
 import logging
 
+sys.path.insert(0, join(dirname(__file__), '..'))  # shared helpers in ../icp
+from icp import IcpClient, iter_pages
+from icp.columns import compile_columns, labels
+from icp.pagination import DEFAULT_PREFETCH
+from icp.records import record_type
+
 log = logging.getLogger(__name__)
 
-load_dotenv(join(dirname(__file__), '.env'))
+# worker processes (the workbook builders of send_buyer_reports, multi-instance-export) import this script again,
+# they build workbooks or set their own client, so the configuration and the API client are set up only once
+worker_process = multiprocessing.current_process().name != 'MainProcess'
+
+if not worker_process:
+    load_dotenv(join(dirname(__file__), '.env'))
 
 icp_authorization_token = os.environ.get("ICP_AUTHORIZATION_TOKEN")
 icp_instance_slug = os.environ.get("ICP_INSTANCE_SLUG")
 
-headers = {
-    'X-Auth-Token': icp_authorization_token,
-    'Accept': 'application/json',
-    'Content-type': 'application/json'
-}
+client = None if worker_process else IcpClient(icp_instance_slug, icp_authorization_token)
+
+# invoices keep only the fields used by the reports, the rest is dropped as soon as a page is decoded
+# values repeated by many invoices (buyers, dates, currencies) are stored once
+Invoice = record_type(
+    'Invoice',
+    ('id', 'no', 'kind', 'buyerVatId', 'buyerName', 'toPay', 'alreadyPaid', 'currencyCode', 'dateDeadline',
+     'dateIssue', 'sellerCreatorName'),
+    shared=('kind', 'buyerVatId', 'buyerName', 'currencyCode', 'dateDeadline', 'dateIssue', 'sellerCreatorName'),
+)
+
+# ask the API for these fields only (sparse fieldsets), set to False to receive whole invoices
+sparse_fieldsets = True
+
+# processes building the per-buyer workbooks, see send_buyer_reports
+report_workers = int(os.environ.get("REPORT_WORKERS") or os.cpu_count())
+
+# buyer VAT ID -> email addresses of the per-buyer reports, relative to the working directory
+buyer_emails_file = os.environ.get("BUYER_EMAILS_FILE") or 'buyer-emails.csv'
+
 
-icp_api_url = f"https://app.icproject.com/api/instance/{icp_instance_slug}"
+def env_flag(name) -> bool:
+    """
+    :return: The environment variable is set to 1, true, yes or on (any case), so e.g. "False" and "0" are off
+    """
+    return (os.environ.get(name) or '').strip().lower() in ('1', 'true', 'yes', 'on')
 
 
 def money(v):
     return str("%.2f" % v).replace(".", ",")
 
 
-def retrieve_unpaid_invoices() -> list:
-    page = 1
-    per_page = 100
+def retrieve_unpaid_invoices(prefetch: int = DEFAULT_PREFETCH) -> Iterator[Invoice]:
     date = datetime.today() - timedelta(days=1)
-    items = []
-    while True:
-        log.debug(f"Retrieving unpaid invoices, page: {page}",)
-        response = requests.get(
-            f"{icp_api_url}/finance/invoices",
-            params={
-                "page": page,
-                "itemsPerPage": per_page,
-                "isNotPaid": 1,
-                "dateDeadline[before]": date.isoformat(),
-                "order[dateDeadline]": "asc"
-            },
-            headers=headers,
-            timeout=10
-        )
+    log.debug("Retrieving unpaid invoices")
+
+    # pages are requested a few at a time ahead of the consumer
+    return iter_pages(
+        client,
+        "/finance/invoices",
+        params={
+            "isNotPaid": 1,
+            "dateDeadline[before]": date.isoformat(),
+            "order[dateDeadline]": "asc"
+        },
+        prefetch=prefetch,
+        record=Invoice,
+        properties=Invoice.fields if sparse_fieldsets else None,
+    )
+
+
+@lru_cache(maxsize=4096)
+def format_date(value: str) -> str:
+    """
+    Formats an ISO 8601 date from the API as DD.MM.YYYY
+
+    Invoices share few distinct dates, so results are memoized. The date part is sliced
+    directly from the string; anything else falls back to dateutil, imported only then.
+    """
+    if len(value) >= 10 and value[4] == '-' and value[7] == '-':
+        return f"{value[8:10]}.{value[5:7]}.{value[0:4]}"
+    from dateutil import parser
+    return parser.parse(value).strftime('%d.%m.%Y')
+
+
+# columns of the summary sheet, the first 8 make up the import sheet (see icp.columns)
+SUMMARY_COLUMNS = (
+    ('buyerVatId', 'NIP', None),
+    ('buyerName', 'Nazwa kontrahenta', None),
+    (None, 'Kraj kontrahenta', lambda invoice: 'PL'),
+    ('no', 'Numer faktury', None),
+    ('toPay', 'Kwota', money),
+    (None, 'Kwota [pozostało]', lambda invoice: money(invoice['toPay'] - invoice['alreadyPaid'])),
+    ('currencyCode', 'Waluta', None),
+    ('dateDeadline', 'Data wymagalności', format_date),
+    ('sellerCreatorName', 'Wystawił', None),
+    ('dateIssue', 'Data wystawienia', format_date),
+    ('kind', 'Rodzaj', None),
+    ('id', 'Link', lambda id: f"https://app.icproject.com/{icp_instance_slug}/finance/invoice/update/{id}"),
+)
+SUMMARY_HEADER = tuple(labels(SUMMARY_COLUMNS))
+IMPORT_COLUMNS = 8
+
+summary_row = compile_columns(SUMMARY_COLUMNS)
+
+
+def create_xls(invoices: Iterable[Invoice]) -> (str, int):
+    log.debug("creating excel")
+    fn = f"invoices-to-pay-{datetime.now().strftime('%Y-%m-%d')}.xlsx"
+    to_pay = write_xls(invoices, fn)
+    log.debug("excel created")
 
-        items += response.json()
+    return fn, to_pay
 
-        if len(response.json()) < per_page:
-            break
 
-        page = page + 1
+def create_buyer_xls(invoices: list) -> (str, bytes, int):
+    """
+    Builds the workbook of a single buyer in memory, runs in a worker process
 
-    return items
+    :param invoices: Unpaid invoices of the buyer
+    :return: Buyer VAT ID, workbook content and the amount left to pay
+    """
+    buffer = BytesIO()
+    to_pay = write_xls(invoices, buffer)
+    return invoices[0]['buyerVatId'], buffer.getvalue(), to_pay
 
 
-def create_xls(invoices: list) -> (str, int):
-    log.debug("creating excel")
-    fn = f"invoices-to-pay-{datetime.now().strftime('%Y-%m-%d')}.xlsx"
-
-    wb = Workbook()
+def write_xls(invoices: Iterable[Invoice], target) -> int:
+    """
+    :param invoices: Unpaid invoices
+    :param target: File name or binary file object
+    :return: Amount left to pay
+    """
+    # write-only workbook, rows are streamed to disk instead of being kept in memory
+    wb = Workbook(write_only=True)
 
-    wb.remove(wb.active)
     ws_0 = wb.create_sheet("Podsumowanie", 0)
     ws_1 = wb.create_sheet("Do importu", 1)
 
-    ws_0.append([
-        "Dane do importu znajdują się na drugim arkuszu!"
-    ])
-    ws_0.append([])
-    ws_0.merge_cells("A1:L2")
+    title = WriteOnlyCell(ws_0, value="Dane do importu znajdują się na drugim arkuszu!")
+    title.fill = PatternFill(start_color='FFFF0000', end_color='FFFF0000', fill_type='solid')
+    title.alignment = Alignment(horizontal='center', vertical='center')
+    title.font = Font(color='FFFFFF', size=12)
 
-    ws_0['A1'].fill = PatternFill(start_color='FFFF0000', end_color='FFFF0000', fill_type='solid')
-    ws_0['A1'].alignment = Alignment(horizontal='center', vertical='center')
-    ws_0['A1'].font = Font(color='FFFFFF', size=12)
+    ws_0.append([title])
+    ws_0.append([])
+    ws_0.merged_cells.add("A1:L2")
 
-    ws_0.append([
-        'NIP',
-        'Nazwa kontrahenta',
-        'Kraj kontrahenta',
-        'Numer faktury',
-        'Kwota',
-        'Kwota [pozostało]',
-        'Waluta',
-        'Data wymagalności',
-        'Wystawił',
-        'Data wystawienia',
-        'Rodzaj',
-        'Link'
-    ])
-    ws_1.append([
-        'NIP',
-        'Nazwa kontrahenta',
-        'Kraj kontrahenta',
-        'Numer faktury',
-        'Kwota',
-        'Kwota [pozostało]',
-        'Waluta',
-        'Data wymagalności',
-    ])
+    ws_0.append(list(SUMMARY_HEADER))
+    ws_1.append(list(SUMMARY_HEADER[:IMPORT_COLUMNS]))
 
     to_pay = 0
     for invoice in invoices:
-        deadline = parser.parse(invoice['dateDeadline'])
         to_pay += invoice['toPay'] - invoice['alreadyPaid']
 
-        ws_0.append([
-            invoice['buyerVatId'],
-            invoice['buyerName'],
-            'PL',
-            invoice['no'],
-            money(invoice['toPay']),
-            money(invoice['toPay'] - invoice['alreadyPaid']),
-            invoice['currencyCode'],
-            deadline.strftime('%d.%m.%Y'),
-            invoice['sellerCreatorName'],
-            parser.parse(invoice['dateIssue']).strftime('%d.%m.%Y'),
-            invoice['kind'],
-            f"https://app.icproject.com/{icp_instance_slug}/finance/invoice/update/{invoice['id']}"
-        ])
-        ws_1.append([
-            invoice['buyerVatId'],
-            invoice['buyerName'],
-            'PL',
-            invoice['no'],
-            money(invoice['toPay']),
-            money(invoice['toPay'] - invoice['alreadyPaid']),
-            invoice['currencyCode'],
-            deadline.strftime('%d.%m.%Y'),
-        ])
+        # columns shared by both sheets are computed once
+        row = summary_row(invoice)
+        ws_1.append(row[:IMPORT_COLUMNS])
+        ws_0.append(row)
 
     ws_0.append([
         "",
@@ -156,15 +194,15 @@ def create_xls(invoices: list) -> (str, int):
         "",
     ])
 
-    wb.save(fn)
+    wb.save(target)
 
-    log.debug("excel created")
-
-    return fn, to_pay
+    return to_pay
 
 
-def send_mail(send_from, send_to, subject, text, files=None):
-    log.debug("sending mail")
+def build_message(send_from, send_to, subject, text, attachments=()) -> MIMEMultipart:
+    """
+    :param attachments: (file name, content) pairs
+    """
     msg = MIMEMultipart()
     msg['From'] = send_from
     msg['To'] = ", ".join(send_to)
@@ -173,45 +211,138 @@ def send_mail(send_from, send_to, subject, text, files=None):
 
     msg.attach(MIMEText(text))
 
-    for f in files or []:
-        with open(f, "rb") as fil:
-            part = MIMEApplication(
-                fil.read(),
-                Name=basename(f)
-            )
-        # After the file is closed
-        part['Content-Disposition'] = 'attachment; filename="%s"' % basename(f)
+    for name, content in attachments:
+        part = MIMEApplication(content, Name=name)
+        part['Content-Disposition'] = 'attachment; filename="%s"' % name
         msg.attach(part)
+    return msg
+
 
+def smtp_connect() -> smtplib.SMTP:
     smtp = smtplib.SMTP(os.environ.get("SMTP_HOST"), int(os.environ.get("SMTP_PORT")))
     if os.environ.get("SMTP_USE_TLS"):
         smtp.starttls()
     smtp.login(os.environ.get("SMTP_USERNAME"), os.environ.get("SMTP_PASSWORD"))
+    return smtp
+
+
+def send_mail(send_from, send_to, subject, text, files=None):
+    log.debug("sending mail")
+    attachments = []
+    for f in files or []:
+        with open(f, "rb") as fil:
+            attachments.append((basename(f), fil.read()))
+    msg = build_message(send_from, send_to, subject, text, attachments)
+
+    smtp = smtp_connect()
     smtp.sendmail(send_from, send_to, msg.as_string())
     smtp.close()
     log.debug("mail sent")
 
 
-if __name__ == '__main__':
+def read_buyer_emails(path) -> dict:
+    """
+    :param path: CSV file with the columns NIP and email, several addresses separated by commas
+    :return: Buyer VAT ID -> list of email addresses
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        return {row['NIP']: [a.strip() for a in row['email'].split(',') if a.strip()] for row in csv.DictReader(f)}
+
+
+def send_buyer_reports(invoices: Iterable[Invoice], buyer_emails: dict, send_from,
+                       workers=report_workers) -> (int, list):
+    """
+    Sends every buyer a reminder with the workbook of its own unpaid invoices
+
+    Workbooks are built in memory by a pool of worker processes and the messages are sent over
+    a single SMTP session while the remaining workbooks are still being built.
+
+    :param invoices: Unpaid invoices
+    :param buyer_emails: Buyer VAT ID -> list of email addresses, buyers missing here are skipped
+    :param send_from: Sender address
+    :param workers: Number of worker processes
+    :return: Number of sent messages and the VAT IDs of the buyers whose message failed
+    """
+    by_buyer = {}
+    for invoice in invoices:
+        if invoice['buyerVatId'] in buyer_emails:
+            by_buyer.setdefault(invoice['buyerVatId'], []).append(invoice)
+        else:
+            log.debug(f"no email address of {invoice['buyerVatId']}, invoice {invoice['no']} skipped")
+
+    date = datetime.now().strftime('%d.%m.%Y')
+    sent = 0
+    failed = []
+    smtp = smtp_connect()
+    try:
+        # workers import this script by name (directly or as icp.scripts.unpaid_report) and unpickle the
+        # invoices there, the same on every platform instead of relying on the state inherited with fork
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            # results arrive in order, each one is sent as soon as it is ready
+            for vat_id, content, to_pay in executor.map(create_buyer_xls, by_buyer.values(), chunksize=16):
+                msg = build_message(
+                    send_from,
+                    buyer_emails[vat_id],
+                    f"[ICP] Nieopłacone faktury na dzień {date}",
+                    f"Liczba nieopłaconych faktur: {len(by_buyer[vat_id])}, na kwotę {money(to_pay)}",
+                    [(f"invoices-to-pay-{vat_id}-{datetime.now().strftime('%Y-%m-%d')}.xlsx", content)]
+                )
+                try:
+                    try:
+                        smtp.sendmail(send_from, buyer_emails[vat_id], msg.as_string())
+                    except smtplib.SMTPServerDisconnected:
+                        # the server closed an idle or long-lived session, send again over a new one
+                        smtp = smtp_connect()
+                        smtp.sendmail(send_from, buyer_emails[vat_id], msg.as_string())
+                except (smtplib.SMTPException, OSError) as e:
+                    # a failed resend or reconnect fails this buyer only, the next one tries to reconnect again
+                    log.error(f"sending to {vat_id} failed: {e}")
+                    failed.append(vat_id)
+                    continue
+                sent += 1
+    finally:
+        try:
+            smtp.quit()
+        except smtplib.SMTPException:
+            smtp.close()
+
+    log.debug(f"{sent} buyer reports sent, {len(failed)} failed")
+    return sent, failed
+
+
+def main() -> int:
     logging.basicConfig(filename='icp-cashcollector.log', level=logging.DEBUG, format='%(asctime)s %(message)s')
     log.debug("start")
 
     try:
-        unpaid_invoices = retrieve_unpaid_invoices()
+        unpaid_invoices = list(retrieve_unpaid_invoices())
     except Exception as e:
         log.error(e)
-        sys.exit(1)
+        return 1
 
     _len = len(unpaid_invoices)
     if _len == 0:
         log.debug("no unpaid invoices")
-        sys.exit(1)
+        return 1
+
+    if env_flag("PER_BUYER_REPORTS"):
+        # one reminder per buyer instead of a single summary
+        try:
+            sent, failed = send_buyer_reports(
+                unpaid_invoices,
+                read_buyer_emails(buyer_emails_file),
+                os.environ.get("SEND_FROM"),
+            )
+        except Exception as e:
+            log.error(e)
+            return 1
+        return 1 if failed else 0
 
     try:
         xls_fn, to_pay = create_xls(unpaid_invoices)
     except Exception as e:
         log.error(e)
-        sys.exit(1)
+        return 1
 
     content = f"Liczba nieopłaconych faktur: {_len}, na kwotę {to_pay}"
 
@@ -226,4 +357,9 @@ if __name__ == '__main__':
         os.remove(xls_fn)
     except Exception as e:
         log.error(e)
-        sys.exit(1)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,46 +1,85 @@
-import csv
-import requests
+import os
+import sys
+from os.path import join, dirname
 
-# Path to the CSV file and API details
+sys.path.insert(0, join(dirname(__file__), '..'))  # shared helpers in ../icp
+from icp import IcpClient
+from icp.bulk import import_rows
+from icp.columns import compile_mapping
+from icp.journal import ImportJournal
+from icp.validation import preflight
+
+# Path to the CSV file and API details, the slug and the key can also be set in the environment
 CSV_FILE_PATH = 'sample-contractors.csv'  # Path to your CSV file
-ICP_SLUG = 'your_ic_project_slug'  # Your IC Project slug
-API_ENDPOINT = f'https://app.icproject.com/api/instance/{ICP_SLUG}/crm/contractors'
-API_KEY = 'your_api_key'  # Your API key
+ICP_SLUG = os.environ.get("ICP_INSTANCE_SLUG", 'your_ic_project_slug')  # Your IC Project slug
+API_ENDPOINT = '/crm/contractors'
+API_KEY = os.environ.get("ICP_AUTHORIZATION_TOKEN", 'your_api_key')  # Your API key
+WORKERS = 8  # Number of contractors sent in parallel
+
+# Pooled client, sends the headers required by the API with every request
+client = IcpClient(ICP_SLUG, API_KEY, pool_size=WORKERS)
+
+# Columns of the CSV file: name, kind, required (True: value, False: column only, None: optional column)
+SCHEMA = (
+    ('name', 'text', True),
+    ('email', 'email', None),
+    ('phone', 'text', None),
+)
+
+# Contractor fields, consecutively API key, CSV column and optional conversion; compiled once into a single function
+build_contractor = compile_mapping((
+    ('name', 'name', None),  # Required field: contractor's name
+    # Optional fields below, uncomment if needed:
+    # ('email', 'email', None),  # Optional: contractor's email
+    # ('phoneNumber', 'phone', None),  # Optional: phone number
+    # ("fullName", 'fullName', None),  # Optional: full name
+    # ("vatId", 'vatId', None),  # Optional: VAT ID
+    # ("paymentDays", 'paymentDays', int),  # Optional: payment days
+    # ("description", 'description', None),  # Optional: description
+    # ("tags", 'tags', lambda v: v.split(',')),  # Optional: tags, e.g. "497f6eca-6276-4993-bfeb-53cbbbba6f08"
+    # ("industryBranches", 'industryBranches', lambda v: v.split(',')),  # Optional: industry branches
+    # ("contactInfo", 'contactEmail',
+    #  lambda v: [{"type": "email", "value": v, "isDefault": True}]),  # Optional: contact info
+))
 
-# Headers required by the API
-headers = {
-    'X-Auth-Token': API_KEY,  # Authorization token
-    'Content-Type': 'application/json',  # Content type for the request
-    'Accept': 'application/json',  # Expected response type
-}
+# Function to send a single CSV row to the API
+def send_contractor(row):
+    contractor_data = build_contractor(row)
+    # Sending POST request to the API
+    return client.post(API_ENDPOINT, json=contractor_data)
+
+# Function to report the result of a single row
+def print_result(result):
+    if result.ok:
+        print(f"Contractor {result.row['name']} added successfully.")
+    else:
+        print(f"Error adding contractor {result.row['name']}: {result.error}")
 
 # Function to read the CSV and send data to the API
-def main(csv_file):
-    with open(csv_file, newline='', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            contractor_data = {
-                'name': row['name'],  # Required field: contractor's name
-                # Optional fields below, uncomment if needed:
-                # 'email': row['email'],  # Optional: contractor's email
-                # 'phoneNumber': row['phone'],  # Optional: phone number
-                # "fullName": "string",  # Optional: full name
-                # "vatId": "string",  # Optional: VAT ID
-                # "paymentDays": 0,  # Optional: payment days
-                # "description": "string",  # Optional: description
-                # "tags": [ "497f6eca-6276-4993-bfeb-53cbbbba6f08" ],  # Optional: tags
-                # "industryBranches": [ "497f6eca-6276-4993-bfeb-53cbbbba6f08" ],  # Optional: industry branches
-                # "contactInfo": [
-                #     { "type": "string", "value": "string", "isDefault": True }  # Optional: contact info
-                # ],
-            }
-            # Sending POST request to the API
-            response = requests.post(API_ENDPOINT, json=contractor_data, headers=headers)
-            if response.status_code == 201:
-                print(f"Contractor {row['name']} added successfully.")
-            else:
-                print(f"Error adding contractor {row['name']}: {response.status_code}, {response.text}")
+def main(csv_file, resume=False):
+    # Check the whole file before sending anything
+    if not preflight(csv_file, SCHEMA):
+        sys.exit(1)
+
+    # Created contractors are journaled next to the CSV file, --resume continues an interrupted import
+    try:
+        journal = ImportJournal(csv_file, resume=resume)
+    except (FileExistsError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    def on_result(result):
+        journal.record(result)
+        print_result(result)
+
+    with journal:
+        # Rows are read lazily and sent by a pool of WORKERS threads
+        summary = import_rows(journal.pending(), send_contractor, workers=WORKERS, on_result=on_result, numbered=True)
+    summary.print(label=lambda row: row['name'])
+    # the API stayed unavailable, the rows not sent are left for --resume
+    if summary.stopped:
+        sys.exit(1)
 
 # Load contractors from the CSV file and send data to the API
 if __name__ == "__main__":
-    main(CSV_FILE_PATH)
+    main(CSV_FILE_PATH, resume='--resume' in sys.argv)
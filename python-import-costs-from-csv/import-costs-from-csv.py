@@ -1,140 +1,232 @@
 import csv
-import requests
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-
-# Function to fetch existing cost categories from the API
-def get_existing_cost_categories(api_url, headers):
-    response = requests.get(f"{api_url}/finance/cost-categories", headers=headers)
+from os.path import join, dirname
+
+sys.path.insert(0, join(dirname(__file__), '..'))  # shared helpers in ../icp
+from icp import IcpClient, iter_pages
+from icp.bulk import import_rows
+from icp.columns import compile_mapping
+from icp.journal import ImportJournal
+from icp.validation import preflight
+from icp.http_cache import HttpCache
+
+# Function to fetch existing cost categories from the API, as a name -> ID index
+def get_existing_cost_categories(client):
+    response = client.get("/finance/cost-categories")
     if response.status_code == 200:
-        return {category['name']: category for category in response.json()}
+        return {category['name']: category['id'] for category in response.json()}
     else:
         print(f"Error fetching cost categories: {response.status_code}")
         return {}
 
-# Function to fetch existing tax rates from the API
-def get_existing_tax_rates(api_url, headers):
-    response = requests.get(f"{api_url}/finance/tax-rates", headers=headers)
+# Function to fetch existing tax rates from the API, as a name -> ID index
+def get_existing_tax_rates(client):
+    response = client.get("/finance/tax-rates")
     if response.status_code == 200:
-        return {tax_rate['name']: tax_rate for tax_rate in response.json()}
+        return {tax_rate['name']: tax_rate['id'] for tax_rate in response.json()}
     else:
         print(f"Error fetching tax rates: {response.status_code}")
         return {}
 
-# Function to fetch existing projects from the API
-def get_existing_projects(api_url, headers):
-    response = requests.get(f"{api_url}/project/projects", headers=headers)
-    if response.status_code == 200:
-        return {project['name']: project for project in response.json()}
-    else:
-        print(f"Error fetching projects: {response.status_code}")
+# Function to fetch existing projects from the API, as a name -> ID index
+def get_existing_projects(client, names):
+    # Projects are read page by page and only the IDs of the projects used in the CSV are kept
+    try:
+        return {project['name']: project['id'] for project in iter_pages(client, "/project/projects")
+                if project['name'] in names}
+    except Exception as e:
+        print(f"Error fetching projects: {e}")
         return {}
 
 # Function to create a new cost category
-def create_cost_category(name, api_url, headers):
+def create_cost_category(name, client):
     data = {
         "name": name,
     }
-    response = requests.post(f"{api_url}/finance/cost-categories", headers=headers, json=data)
+    response = client.post("/finance/cost-categories", json=data)
     if response.status_code == 201:
-        return response.json()
+        return response.json()['id']
     else:
         print(f"Error creating cost category {name}: {response.status_code}, {response.text}")
         return None
 
 # Function to create a new tax rate
-def create_tax_rate(name, value, api_url, headers):
+def create_tax_rate(name, value, client):
     data = {
         "name": name,
         "value": value,
         "isDefault": False
     }
-    response = requests.post(f"{api_url}/finance/tax-rates", headers=headers, json=data)
+    response = client.post("/finance/tax-rates", json=data)
     if response.status_code == 201:
-        return response.json()
+        return response.json()['id']
     else:
         print(f"Error creating tax rate {name}: {response.status_code}, {response.text}")
         return None
 
+# Function to collect the distinct reference data used in the CSV
+def scan_reference_data(file_path):
+    """
+    Reads the CSV once and collects the names of the cost categories, tax rates and projects it uses
+
+    :return: (category names, tax rate name -> value, project names)
+    """
+    category_names = set()
+    tax_rates = {}
+    project_names = set()
+
+    with open(file_path, mode='r', encoding='utf-8-sig') as file:
+        for row in csv.DictReader(file):
+            category_names.add(row['category'])
+            tax_rates.setdefault(row['taxRate'], float(row['taxRateValue']))
+            if row.get('project'):
+                project_names.add(row['project'])
+
+    return category_names, tax_rates, project_names
+
+# Function to build the name -> ID indexes, creating missing categories and tax rates
+def resolve_reference_data(file_path, client, workers=8):
+    """
+    Resolves all cost categories, tax rates and projects used in the CSV before any cost is sent
+
+    Existing data is fetched and missing categories and tax rates are created concurrently.
+
+    :return: (category name -> ID, tax rate name -> ID, project name -> ID)
+    """
+    category_names, tax_rate_values, project_names = scan_reference_data(file_path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Fetch existing cost categories, tax rates, and projects
+        categories = executor.submit(get_existing_cost_categories, client)
+        tax_rates = executor.submit(get_existing_tax_rates, client)
+        projects = executor.submit(get_existing_projects, client, project_names)
+        categories, tax_rates, projects = categories.result(), tax_rates.result(), projects.result()
+
+        # Create the missing ones
+        new_categories = {name: executor.submit(create_cost_category, name, client)
+                          for name in category_names if name not in categories}
+        new_tax_rates = {name: executor.submit(create_tax_rate, name, value, client)
+                         for name, value in tax_rate_values.items() if name not in tax_rates}
+
+        for name, future in new_categories.items():
+            if future.result():
+                categories[name] = future.result()
+        for name, future in new_tax_rates.items():
+            if future.result():
+                tax_rates[name] = future.result()
+
+    return categories, tax_rates, projects
+
 # Function to convert CSV data to JSON format for costs
-def csv_to_costs(file_path, api_url, headers):
-    # Fetch existing cost categories, tax rates, and projects
-    existing_categories = get_existing_cost_categories(api_url, headers)
-    existing_tax_rates = get_existing_tax_rates(api_url, headers)
-    existing_projects = get_existing_projects(api_url, headers)
-
-    costs = []
-
-    # Open the CSV file
-    with open(file_path, mode='r', encoding='utf-8') as file:
-        csv_reader = csv.DictReader(file)
-
-        # Iterate through rows in the CSV
-        for row in csv_reader:
-            # Check if cost category already exists; create new one if not
-            category_name = row['category']
-            if category_name not in existing_categories:
-                new_category = create_cost_category(category_name, api_url, headers)
-                if new_category:
-                    existing_categories[category_name] = new_category
-            cost_category = existing_categories.get(category_name, {})
-
-            # Check if tax rate already exists; create new one if not
-            tax_rate_name = row['taxRate']
-            tax_rate_value = float(row['taxRateValue'])
-            if tax_rate_name not in existing_tax_rates:
-                new_tax_rate = create_tax_rate(tax_rate_name, tax_rate_value, api_url, headers)
-                if new_tax_rate:
-                    existing_tax_rates[tax_rate_name] = new_tax_rate
-            tax_rate = existing_tax_rates.get(tax_rate_name, {})
-
-            # Check if project exists
-            project_name = row.get('project', '')
-            project_id = existing_projects.get(project_name, {}).get('id') if project_name else None
-
-            cost = {
-                "name": row['name'],  # Cost name
-                "description": row['description'],  # Cost description
-                "priceNet": float(row['priceNet']),  # Net price
-                "priceGross": float(row['priceGross']),  # Gross price
-                "date": row['date'],  # Date
-                "isBilled": row['isBilled'].lower() == 'true',  # Is billed
-                "isPosted": row['isPosted'].lower() == 'true',  # Is posted
-                "createdAt": datetime.now().isoformat(),  # Created at
-                "updatedAt": datetime.now().isoformat(),  # Updated at
-                "costCategory": cost_category.get('id'),  # Cost category
-                "taxRate": tax_rate.get('id'),  # Tax rate
-                "financeProject": project_id  # Project ID, if exists
-            }
-
-            costs.append(cost)
-
-    return costs
+def csv_to_costs(rows, categories, tax_rates, projects):
+    """
+    Yields costs converted from the CSV rows, one row at a time
+
+    :param rows: (row number, row) pairs, e.g. from `ImportJournal.pending`
+    :param categories: Cost category name -> ID
+    :param tax_rates: Tax rate name -> ID
+    :param projects: Project name -> ID
+    """
+    # Cost fields, consecutively API key, CSV column and optional conversion; compiled once into a single function
+    build_cost = compile_mapping((
+        ("name", 'name', None),  # Cost name
+        ("description", 'description', None),  # Cost description
+        ("priceNet", 'priceNet', float),  # Net price
+        ("priceGross", 'priceGross', float),  # Gross price
+        ("date", 'date', None),  # Date
+        ("isBilled", 'isBilled', lambda v: v.lower() == 'true'),  # Is billed
+        ("isPosted", 'isPosted', lambda v: v.lower() == 'true'),  # Is posted
+        ("createdAt", None, lambda row: datetime.now().isoformat()),  # Created at
+        ("updatedAt", None, lambda row: datetime.now().isoformat()),  # Updated at
+        ("costCategory", 'category', categories.get),  # Cost category
+        ("taxRate", 'taxRate', tax_rates.get),  # Tax rate
+        # Project ID, if exists
+        ("financeProject", None, lambda row: projects.get(row['project']) if row.get('project') else None),
+    ))
+
+    # Rows are read lazily
+    for number, row in rows:
+        yield number, build_cost(row)
+
+# Function to report the result of a single cost
+def print_result(result):
+    if result.ok:
+        print(f"Success: Cost {result.row['name']} was sent.")
+    else:
+        print(f"Error: Failed to send cost {result.row['name']}: {result.error}")
 
 # Function to send cost data to the API
-def send_costs_to_api(costs, api_url, headers):
-    # Iterate through each cost and send data to the API
-    for cost in costs:
-        response = requests.post(f"{api_url}/finance/costs", headers=headers, json=cost)
-        if response.status_code == 201:
-            print(f"Success: Cost {cost['name']} was sent.")
-        else:
-            print(f"Error: Failed to send cost {cost['name']}. Response code: {response.status_code}, error: {response.text}")
-
-# Example usage
+def send_costs_to_api(costs, client, workers=8, journal=None):
+    def on_result(result):
+        if journal:
+            journal.record(result)
+        print_result(result)
+
+    # Send costs with a pool of worker threads, `workers` at a time
+    summary = import_rows(
+        costs,
+        lambda cost: client.post("/finance/costs", json=cost),
+        workers=workers,
+        on_result=on_result,
+        numbered=True,
+    )
+    summary.print(label=lambda cost: cost['name'])
+    return summary
+
+# Columns of the CSV file: name, kind, required (True: value, False: column only, None: optional column)
+COSTS_SCHEMA = (
+    ('name', 'text', True),
+    ('description', 'text', False),
+    ('priceNet', 'number', True),
+    ('priceGross', 'number', True),
+    ('date', 'date', True),
+    ('isBilled', 'bool', True),
+    ('isPosted', 'bool', True),
+    ('category', 'text', True),
+    ('taxRate', 'text', True),
+    ('taxRateValue', 'number', True),
+    ('project', 'text', None),
+)
+
+# Example usage, the slug and the key can also be set in the environment
 csv_file = 'sample-costs.csv'  # Path to the CSV file
-instance_slug = 'your-instance-slug'  # Your instance slug
-api_url = f'https://app.icproject.com/api/instance/{instance_slug}'  # API endpoint
-api_key = 'your-api-key'  # Your API key
-
-# Headers for authorization and content type
-headers = {
-    'X-Auth-Token': api_key,  # Authorization token
-    'Content-Type': 'application/json',  # Content type for the request
-    'Accept': 'application/json',  # Expected response type
-}
-
-# Convert CSV data
-costs_data = csv_to_costs(csv_file, api_url, headers)
-
-# Send data to the API
-send_costs_to_api(costs_data, api_url, headers)
+instance_slug = os.environ.get("ICP_INSTANCE_SLUG", 'your-instance-slug')  # Your instance slug
+api_key = os.environ.get("ICP_AUTHORIZATION_TOKEN", 'your-api-key')  # Your API key
+workers = 8  # Number of costs sent in parallel
+
+# Pooled client, sends the authorization headers with every request
+# Cost categories, tax rates and projects are cached on disk between runs and revalidated on every run (ETag)
+client = IcpClient(instance_slug, api_key, pool_size=workers, cache=HttpCache())
+
+# Function to run the import of a CSV file
+def main(csv_file, resume=False):
+    # Check the whole file before any category, tax rate or cost is created
+    if not preflight(csv_file, COSTS_SCHEMA):
+        sys.exit(1)
+
+    # Created costs are journaled next to the CSV file, run with --resume to continue an interrupted import
+    try:
+        journal = ImportJournal(csv_file, resume=resume)
+    except (FileExistsError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    # Resolve cost categories, tax rates and projects first
+    categories, tax_rates, projects = resolve_reference_data(csv_file, client, workers)
+
+    with journal:
+        # Convert CSV data, rows are read lazily while costs are sent
+        costs_data = csv_to_costs(journal.pending(), categories, tax_rates, projects)
+
+        # Send data to the API
+        summary = send_costs_to_api(costs_data, client, workers, journal)
+
+    # the API stayed unavailable, the costs not sent are left for --resume
+    if summary.stopped:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(csv_file, resume='--resume' in sys.argv)
@@ -1,53 +1,91 @@
-import csv
-import requests
+import os
+import sys
+from os.path import join, dirname
+
+sys.path.insert(0, join(dirname(__file__), '..'))  # shared helpers in ../icp
+from icp import IcpClient
+from icp.bulk import import_rows
+from icp.journal import ImportJournal
+from icp.validation import preflight
 
 """
 You can find authorization token and instance slug in your instance settings panel.
+They can also be set in the ICP_AUTHORIZATION_TOKEN and ICP_INSTANCE_SLUG environment variables.
 """
-authorization_token = ""
-instance_slug = ""
-
-# open csv file
-with open('sample-projects.csv') as csvfile:
-    # csv reader
-    reader = csv.reader(csvfile, delimiter=',')
-
-    # skip first row (header)
-    next(reader, None)
-
-    # loop
-    for project_name, date_start, date_end, description, status in reader:
-        print(f"Creating project: {project_name}", end="")
-
-        # https://developers.icproject.com/api-documentation/#tag/Project/operation/postProjectCollection
-        params = {
-            "name": project_name,
-            "dateStartPlanned": date_start,
-            "dateEndPlanned": date_end,
-            "category": None,
-            "tags": None,
-            "description": description,
-            "isBlameableRemovalEnabled": True,
-            "status": status,
-            "budget": 0
-        }
-
-        # necessary headers
-        headers = {
-            'X-Auth-Token': authorization_token,
-            'Accept': 'application/json',
-            'Content-type': 'application/json'
-        }
-
-        # make a request
-        response = requests.post(
-            f"https://app.icproject.com/api/instance/{instance_slug}/project/projects",
-            json=params,
-            headers=headers,
-        )
-
-        print("\t", response.status_code)
-
-        # errors?
-        if response.status_code != 200:
-            print(response.content)
+authorization_token = os.environ.get("ICP_AUTHORIZATION_TOKEN", "")
+instance_slug = os.environ.get("ICP_INSTANCE_SLUG", "")
+
+# number of projects created in parallel
+workers = 8
+
+# pooled client, sends the necessary headers with every request
+client = IcpClient(instance_slug, authorization_token, pool_size=workers)
+
+csv_file_path = 'sample-projects.csv'
+
+# columns of the CSV file, consecutively name, kind, required and allowed values (see icp/validation.py)
+# add the other project statuses used in your instance to the list
+schema = (
+    ('project_name', 'text', True),
+    ('date_start', 'datetime', True),
+    ('date_end', 'datetime', True),
+    ('description', 'text', False),
+    ('status', 'text', True, ('in-preparation', 'open')),
+)
+
+
+def send_project(row):
+    # columns are read by name, as validated by the schema, so their order in the file does not matter
+    # https://developers.icproject.com/api-documentation/#tag/Project/operation/postProjectCollection
+    params = {
+        "name": row['project_name'],
+        "dateStartPlanned": row['date_start'],
+        "dateEndPlanned": row['date_end'],
+        "category": None,
+        "tags": None,
+        "description": row['description'],
+        "isBlameableRemovalEnabled": True,
+        "status": row['status'],
+        "budget": 0
+    }
+
+    # make a request
+    return client.post("/project/projects", json=params)
+
+
+def print_result(result):
+    print(f"Creating project: {result.row['project_name']}\t", result.status_code)
+
+    # errors?
+    if not result.ok:
+        print(result.error)
+
+
+def main(csv_file, resume=False):
+    # the whole file is checked before any project is created
+    if not preflight(csv_file, schema):
+        sys.exit(1)
+
+    # created projects are journaled next to the csv file, run with --resume to continue an interrupted import
+    try:
+        journal = ImportJournal(csv_file, resume=resume)
+    except (FileExistsError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    def on_result(result):
+        journal.record(result)
+        print_result(result)
+
+    with journal:
+        # rows are read lazily as dictionaries keyed by the header and sent by a pool of worker threads
+        summary = import_rows(journal.pending(), send_project, workers=workers, on_result=on_result, numbered=True)
+
+    summary.print(label=lambda row: row['project_name'])
+    # the API stayed unavailable, the rows not sent are left for --resume
+    if summary.stopped:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(csv_file_path, resume='--resume' in sys.argv)
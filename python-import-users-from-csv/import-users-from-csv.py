@@ -1,12 +1,35 @@
-import pandas as pd
-import requests
-import json
+import os
+import sys
+from os.path import join, dirname
 
-# Configuration
+sys.path.insert(0, join(dirname(__file__), '..'))  # shared helpers in ../icp
+from icp import IcpClient
+from icp.bulk import import_rows
+from icp.journal import ImportJournal
+from icp.validation import preflight
+
+# Configuration, the slug and the key can also be set in the environment
 CSV_FILE_PATH = 'sample-users.csv'
-ICP_SLUG = 'your_ic_project_slug'  # Replace with actual slug
-API_ENDPOINT = f'https://app.icproject.com/api/instance/{ICP_SLUG}/user/users'
-API_KEY = 'your_api_key'  # Replace with actual API key
+ICP_SLUG = os.environ.get("ICP_INSTANCE_SLUG", 'your_ic_project_slug')  # Replace with actual slug
+API_ENDPOINT = '/user/users'
+API_KEY = os.environ.get("ICP_AUTHORIZATION_TOKEN", 'your_api_key')  # Replace with actual API key
+WORKERS = 8  # Number of users sent in parallel
+
+# Pooled client, sends the authorization headers with every request
+client = IcpClient(ICP_SLUG, API_KEY, pool_size=WORKERS)
+
+# Columns of the CSV file: name, kind, required (True: value, False: column only, None: optional column)
+SCHEMA = (
+    ('email', 'email', True),
+    ('firstName', 'text', True),
+    ('lastName', 'text', True),
+    ('canLogIn', 'bool', None),
+    ('phoneNumber', 'text', None),
+    ('jobPosition', 'text', None),
+    ('department', 'text', None),
+    ('roleSets', 'text', None),
+    ('hourlyRate', 'number', None),
+)
 
 
 # Function to transform a CSV row into JSON format
@@ -15,41 +38,64 @@ def transform_row(row):
     Transforms a row from the CSV file into a JSON dictionary for a user.
 
     This function takes a row from the CSV file and returns a dictionary with user data in JSON format.
-    Missing values are filled with default values.
+    Missing or empty values are filled with default values.
     """
     # Create a JSON dictionary for the user
     return {
         "email": row['email'],  # User's email address
         "firstName": row['firstName'],  # User's first name
         "lastName": row['lastName'],  # User's last name
-        "canLogIn": row.get('canLogIn', 'true').lower() == 'true',  # Whether the user can log in (default is true)
-        "phoneNumber": row.get('phoneNumber', ''),  # User's phone number (optional)
-        "jobPosition": row.get('jobPosition', 'default-job-position-id'),  # User's job position (optional)
-        "department": row.get('department', 'default-department-id'),  # User's department (optional)
-        "roleSets": [row.get('roleSets', 'default-role-set-id')],  # List of user roles (optional)
-        "hourlyRate": float(row.get('hourlyRate', 0))  # User's hourly rate (optional, default is 0)
+        "canLogIn": (row.get('canLogIn') or 'true').lower() == 'true',  # Whether the user can log in (default is true)
+        "phoneNumber": row.get('phoneNumber') or '',  # User's phone number (optional)
+        "jobPosition": row.get('jobPosition') or 'default-job-position-id',  # User's job position (optional)
+        "department": row.get('department') or 'default-department-id',  # User's department (optional)
+        "roleSets": [row.get('roleSets') or 'default-role-set-id'],  # List of user roles (optional)
+        "hourlyRate": float(row.get('hourlyRate') or 0)  # User's hourly rate (optional, default is 0)
     }
 
-# Load data from the CSV file
-df = pd.read_csv(CSV_FILE_PATH)
 
-# Process each row and send data to the API
-for index, row in df.iterrows():
+# Function to send a single row to the API, runs in a worker thread
+def send_user(row):
     user_data = transform_row(row)
-    print(f"Preparing data for user: {user_data['email']}")
+    return client.post(API_ENDPOINT, json=user_data)
 
-    headers = {
-        'X-Auth-Token': API_KEY,  # Authorization header
-        'Content-Type': 'application/json',  # Content type
-        'Accept': 'application/json',  # Acceptable response type
-    }
-
-    response = requests.post(API_ENDPOINT, headers=headers, data=json.dumps(user_data))
 
-    # Check the API response
-    if response.status_code == 201:
-        print(f"User {user_data['email']} has been successfully added.")
+# Function to check the API response of a single row
+def print_result(result):
+    if result.ok:
+        print(f"User {result.row['email']} has been successfully added.")
     else:
-        print(f"Error adding user {user_data['email']}: {response.status_code} - {response.text}")
+        print(f"Error adding user {result.row['email']}: {result.error}")
+
+
+def main(csv_file, resume=False):
+    # Check the whole file before sending anything
+    if not preflight(csv_file, SCHEMA):
+        sys.exit(1)
+
+    # Created users are journaled next to the CSV file, --resume continues an interrupted import
+    try:
+        journal = ImportJournal(csv_file, resume=resume)
+    except (FileExistsError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    # Function to journal and report the result of a single row
+    def on_result(result):
+        journal.record(result)
+        print_result(result)
+
+    # Process each row and send data to the API, WORKERS rows at a time
+    # Rows are read lazily as plain dictionaries of strings (empty cells as ''), so memory use stays flat
+    with journal:
+        summary = import_rows(journal.pending(), send_user, workers=WORKERS, on_result=on_result, numbered=True)
+
+    print("Import process completed.")
+    summary.print(label=lambda row: row['email'])
+    # the API stayed unavailable, the rows not sent are left for --resume
+    if summary.stopped:
+        sys.exit(1)
+
 
-print("Import process completed.")
+if __name__ == "__main__":
+    main(CSV_FILE_PATH, resume='--resume' in sys.argv)
@@ -0,0 +1,191 @@
+"""
+Runs an export across many IC Project instances in parallel worker processes
+
+Instances are read from a CSV file with the columns `slug`, `token` and optional `workers`, the number
+of concurrent requests sent to that instance (4 by default). Every instance is exported by its own process,
+at most `--processes` at a time, and the results are merged into one CSV file with an `Instance` column:
+
+    python multi-instance-export.py projects --instances instances.csv --output projects.csv
+    python multi-instance-export.py unpaid-invoices --instances instances.csv --output unpaid-invoices.csv
+    python multi-instance-export.py invoices --instances instances.csv --output invoices.csv
+
+`invoices` downloads the PDFs into `faktury/<slug>/` and lists the downloaded files.
+"""
+import argparse
+import csv
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import join, dirname
+
+sys.path.insert(0, join(dirname(__file__), '..'))  # shared helpers in ../icp
+from icp import IcpClient
+from icp.manifest import FileManifest
+from icp.pagination import DEFAULT_PREFETCH
+from icp.scripts import script_path
+
+DEFAULT_INSTANCE_WORKERS = 4
+
+download_dir = "faktury"
+
+
+def read_instances(path):
+    """
+    :param path: CSV file with the columns slug, token and optional workers
+    :return: List of dictionaries with slug, token and workers
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        return [
+            {
+                "slug": row['slug'],
+                "token": row['token'],
+                "workers": int(row.get('workers') or DEFAULT_INSTANCE_WORKERS),
+            }
+            for row in csv.DictReader(f)
+        ]
+
+
+def load_script(name, instance):
+    """
+    Loads an example script as a fresh module, its module-level client is replaced by the caller
+
+    :param name: Module name of the script in `icp.scripts`, e.g. `export_projects`
+    """
+    spec = importlib.util.spec_from_file_location(f"export_{instance['slug'].replace('-', '_')}", script_path(name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def instance_client(instance, pool_size=None):
+    return IcpClient(instance['slug'], instance['token'], pool_size=pool_size or instance['workers'])
+
+
+def export_projects(instance, writer):
+    module = load_script('export_projects', instance)
+    module.client = instance_client(instance)
+
+    writer.writerow(['Instance'] + [column[1] for column in module.columns])
+    count = 0
+    for project in module.retrieve_projects(prefetch=instance['workers']):
+        writer.writerow([instance['slug']] + module.project_row(project))
+        count += 1
+    module.client.close()
+    return count
+
+
+def export_unpaid_invoices(instance, writer):
+    module = load_script('unpaid_report', instance)
+    module.client = instance_client(instance)
+    module.icp_instance_slug = instance['slug']
+
+    writer.writerow(['Instance'] + list(module.SUMMARY_HEADER))
+    count = 0
+    for invoice in module.retrieve_unpaid_invoices(prefetch=instance['workers']):
+        writer.writerow([instance['slug']] + module.summary_row(invoice))
+        count += 1
+    module.client.close()
+    return count
+
+
+def export_invoices(instance, writer):
+    module = load_script('download_invoices', instance)
+    module.client = instance_client(instance, pool_size=max(instance['workers'], DEFAULT_PREFETCH))
+    module.download_workers = instance['workers']
+    module.download_dir = join(download_dir, instance['slug'])
+    module.manifest_path = join(module.download_dir, ".manifest.sqlite3")
+
+    if module.main():
+        raise RuntimeError("the invoices list could not be retrieved")
+    module.client.close()
+
+    manifest = FileManifest(module.manifest_path)
+    entries = manifest.entries()
+    manifest.close()
+
+    writer.writerow(['Instance', 'Number', 'Updated at', 'File', 'Size', 'SHA-256'])
+    for entry in entries:
+        writer.writerow([instance['slug'], entry['name'], entry['updated_at'], entry['path'], entry['size'],
+                         entry['sha256']])
+    return len(entries)
+
+
+# export name -> function writing the rows of one instance
+EXPORTS = {
+    'projects': export_projects,
+    'unpaid-invoices': export_unpaid_invoices,
+    'invoices': export_invoices,
+}
+
+
+def run_instance(export, instance, part_path):
+    """
+    Exports a single instance into its own part file, runs in a worker process
+
+    :return: Number of exported rows
+    """
+    with open(part_path, 'w', newline='', encoding='utf-8') as f:
+        return EXPORTS[export](instance, csv.writer(f))
+
+
+def merge_parts(part_paths, output):
+    """
+    Concatenates the part files into `output`, keeping the header of the first one only
+    """
+    with open(output, 'w', newline='', encoding='utf-8') as out:
+        header_written = False
+        for part_path in part_paths:
+            with open(part_path, newline='', encoding='utf-8') as part:
+                header = part.readline()
+                if not header_written:
+                    out.write(header)
+                    header_written = True
+                shutil.copyfileobj(part, out)
+            os.remove(part_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('export', choices=EXPORTS)
+    parser.add_argument('--instances', default='instances.csv', help="CSV file with slug, token and workers columns")
+    parser.add_argument('--output', help="merged CSV file, default: <export>.csv")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help="instances exported at once")
+    args = parser.parse_args(argv)
+
+    instances = read_instances(args.instances)
+    output = args.output or f"{args.export}.csv"
+    parts = {instance['slug']: f"{output}.{instance['slug']}.part" for instance in instances}
+
+    failed = []
+    # workers import this script by name (directly or as icp.scripts.multi_export), so they start the same way
+    # on every platform instead of relying on the state inherited with fork
+    with ProcessPoolExecutor(max_workers=max(1, min(args.processes, len(instances))),
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {
+            executor.submit(run_instance, args.export, instance, parts[instance['slug']]): instance['slug']
+            for instance in instances
+        }
+        # the run takes as long as the slowest instance
+        for future in as_completed(futures):
+            slug = futures[future]
+            try:
+                print(f"{slug}: {future.result()} rows")
+            except Exception as e:
+                failed.append(slug)
+                print(f"{slug}: failed: {e}")
+
+    # rows of the successful instances, in the order of the instances file
+    merge_parts([parts[i['slug']] for i in instances if i['slug'] not in failed], output)
+    for slug in failed:
+        if os.path.exists(parts[slug]):
+            os.remove(parts[slug])
+
+    print(f"Exported {len(instances) - len(failed)} of {len(instances)} instances to {output}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
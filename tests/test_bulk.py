@@ -0,0 +1,140 @@
+"""
+Interrupting a journaled import and resuming it sends every row exactly once
+"""
+import csv
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+from os.path import join, dirname
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+from icp.bulk import import_rows
+from icp.governor import CircuitOpenError
+from icp.journal import ImportJournal
+
+ROWS = 200
+WORKERS = 8
+
+
+class FakeResponse:
+    status_code = 201
+
+    def __init__(self, number):
+        self.number = number
+
+    def json(self):
+        return {"id": f"id-{self.number}"}
+
+
+class InterruptedImportTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.csv_path = join(directory.name, 'contractors.csv')
+        with open(self.csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'email'])
+            writer.writerows([f"Contractor {i}", f"c{i}@example.com"] for i in range(1, ROWS + 1))
+
+        self.sent = Counter()
+        self.lock = threading.Lock()
+        self.unavailable_from = None  # rows from this number on fail with CircuitOpenError
+        self.refused = 0
+
+    def send(self, row):
+        time.sleep(0.01)  # rows are still in flight when the import is interrupted
+        number = int(row['name'].split()[1])
+        if self.unavailable_from and number >= self.unavailable_from:
+            with self.lock:
+                self.refused += 1
+            raise CircuitOpenError("Circuit open after 10 consecutive failures")
+        with self.lock:
+            self.sent[number] += 1
+        return FakeResponse(number)
+
+    def run_import(self, resume, interrupt_after=None):
+        with ImportJournal(self.csv_path, resume=resume) as journal:
+            rows = journal.pending()
+            if interrupt_after is not None:
+                rows = interrupted(rows, interrupt_after)
+            return import_rows(rows, self.send, workers=WORKERS, on_result=journal.record, numbered=True)
+
+    def test_resume_after_interrupt_sends_every_row_once(self):
+        with self.assertRaises(KeyboardInterrupt):
+            self.run_import(resume=False, interrupt_after=50)
+        first_run = sum(self.sent.values())
+        self.assertGreater(first_run, 0)
+        self.assertLess(first_run, ROWS)
+
+        # every row sent by the interrupted run is journaled
+        with ImportJournal(self.csv_path, resume=True) as journal:
+            self.assertEqual(len(journal.done), first_run)
+
+        summary = self.run_import(resume=True)
+        self.assertEqual(summary.succeeded, ROWS - first_run)
+        self.assertEqual(sorted(self.sent), list(range(1, ROWS + 1)))
+        self.assertEqual(set(self.sent.values()), {1})
+
+    def test_open_circuit_stops_the_import(self):
+        self.unavailable_from = 60
+        summary = self.run_import(resume=False)
+        self.assertIn("Circuit open", summary.stopped)
+        self.assertEqual((summary.succeeded, summary.failed), (59, 0))
+        # the rows read ahead are dropped, not sent one after another into the open circuit
+        self.assertLessEqual(self.refused, 2 * WORKERS)
+
+        self.unavailable_from = None
+        summary = self.run_import(resume=True)
+        self.assertIsNone(summary.stopped)
+        self.assertEqual(summary.succeeded, ROWS - 59)
+        self.assertEqual(set(self.sent.values()), {1})
+
+    def test_finished_import_removes_its_journal(self):
+        self.run_import(resume=False)
+        self.assertFalse(os.path.exists(f"{self.csv_path}.journal"))
+        # a rerun imports the file again instead of failing on the journal of the previous one
+        self.sent.clear()
+        summary = self.run_import(resume=False)
+        self.assertEqual(summary.succeeded, ROWS)
+
+    def test_resumed_import_removes_its_journal(self):
+        with self.assertRaises(KeyboardInterrupt):
+            self.run_import(resume=False, interrupt_after=50)
+        self.run_import(resume=True)
+        self.assertFalse(os.path.exists(f"{self.csv_path}.journal"))
+
+    def test_existing_journal_requires_resume(self):
+        with self.assertRaises(KeyboardInterrupt):
+            self.run_import(resume=False, interrupt_after=50)
+        with self.assertRaises(FileExistsError):
+            ImportJournal(self.csv_path)
+        self.assertTrue(os.path.exists(f"{self.csv_path}.journal"))
+
+    def test_resume_of_changed_file_is_refused(self):
+        with self.assertRaises(KeyboardInterrupt):
+            self.run_import(resume=False, interrupt_after=50)
+        with open(self.csv_path, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(["Contractor 999", "c999@example.com"])
+        self.sent.clear()
+        with self.assertRaisesRegex(ValueError, "changed since"):
+            self.run_import(resume=True)
+        self.assertFalse(self.sent)
+
+
+def interrupted(rows, after):
+    """
+    Yields `after` rows and then raises KeyboardInterrupt, like Ctrl-C while reading the file
+    """
+    for i, row in enumerate(rows):
+        if i == after:
+            raise KeyboardInterrupt
+        yield row
+
+
+if __name__ == '__main__':
+    unittest.main()
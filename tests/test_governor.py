@@ -0,0 +1,163 @@
+"""
+Circuit breaker, Retry-After pauses, AIMD limit and retry rules of the rate governor
+"""
+import sys
+import threading
+import time
+import unittest
+from os.path import join, dirname
+from unittest import mock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+from icp import governor
+from icp.governor import CircuitOpenError, GovernedAdapter, RateGovernor
+
+COOLDOWN = 0.1
+
+
+def fail(gov, count):
+    for _ in range(count):
+        gov.acquire()
+        gov.release(500, 0.01)
+
+
+def response(status, headers=None):
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update(headers or {})
+    result._content = b""
+    return result
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        gov = RateGovernor(breaker_threshold=3, breaker_cooldown=COOLDOWN, breaker_wait=0)
+        fail(gov, 2)
+        self.assertEqual(gov.state, 'closed')
+        fail(gov, 1)
+        self.assertEqual(gov.state, 'open')
+        with self.assertRaisesRegex(CircuitOpenError, "after 3 consecutive failures"):
+            gov.acquire()
+
+    def test_success_in_flight_keeps_the_circuit_open(self):
+        gov = RateGovernor(breaker_threshold=3, breaker_cooldown=COOLDOWN, breaker_wait=0)
+        gov.acquire()  # sent before the circuit opens
+        fail(gov, 3)
+        gov.release(200, 0.01)
+        self.assertEqual((gov.state, gov.failures), ('open', 3))
+        with self.assertRaisesRegex(CircuitOpenError, "after 3 consecutive failures"):
+            gov.acquire()
+
+    def test_successful_probe_closes(self):
+        gov = RateGovernor(breaker_threshold=1, breaker_cooldown=COOLDOWN, breaker_wait=0)
+        fail(gov, 1)
+        time.sleep(COOLDOWN)
+        gov.acquire()
+        self.assertEqual((gov.state, gov.probing), ('half-open', True))
+        gov.release(200, 0.01)
+        self.assertEqual((gov.state, gov.failures), ('closed', 0))
+
+    def test_failed_probe_opens_again(self):
+        gov = RateGovernor(breaker_threshold=5, breaker_cooldown=COOLDOWN, breaker_wait=0)
+        fail(gov, 5)
+        time.sleep(COOLDOWN)
+        fail(gov, 1)
+        self.assertEqual(gov.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            gov.acquire()
+
+    def test_waiting_request_goes_after_the_probe(self):
+        gov = RateGovernor(breaker_threshold=1, breaker_cooldown=COOLDOWN, breaker_wait=10)
+        fail(gov, 1)
+        gov.acquire()  # the probe, sent once the cooldown is over
+        self.assertEqual(gov.state, 'half-open')
+
+        acquired = threading.Event()
+        waiting = threading.Thread(target=lambda: (gov.acquire(), acquired.set()))
+        waiting.start()
+        self.assertFalse(acquired.wait(0.2))
+        gov.release(200, 0.01)
+        self.assertTrue(acquired.wait(5))
+        waiting.join()
+        self.assertEqual(gov.state, 'closed')
+
+    def test_wait_shorter_than_cooldown_fails_fast(self):
+        gov = RateGovernor(breaker_threshold=1, breaker_cooldown=30, breaker_wait=1)
+        fail(gov, 1)
+        started = time.monotonic()
+        with self.assertRaises(CircuitOpenError):
+            gov.acquire()
+        self.assertLess(time.monotonic() - started, 0.5)
+
+
+class ThrottlingTest(unittest.TestCase):
+
+    def test_retry_after_pauses_the_host(self):
+        gov = RateGovernor()
+        gov.acquire()
+        gov.release(503, 0.01, retry_after='0.3')
+        started = time.monotonic()
+        gov.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.25)
+
+    def test_throttling_halves_the_limit(self):
+        gov = RateGovernor(max_concurrency=16, min_concurrency=2)
+        gov.acquire()
+        gov.release(429, 0.0, retry_after='0')
+        self.assertEqual(gov.limit, 8)
+        for _ in range(4):
+            gov.acquire()
+            gov.release(429, 0.0, retry_after='0')
+        self.assertEqual(gov.limit, 2)
+
+    def test_successes_increase_the_limit(self):
+        gov = RateGovernor(max_concurrency=16)
+        gov.limit = 4.0
+        for _ in range(4):
+            gov.acquire()
+            gov.release(200, 0.01)
+        self.assertGreater(gov.limit, 4.9)
+        self.assertLessEqual(gov.limit, 16)
+
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(governor, 'RETRY_BACKOFF', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self, method, statuses):
+        adapter = GovernedAdapter(governor=RateGovernor(), retries=3)
+        request = requests.Request(method, 'http://icp.test/finance/costs', json={}).prepare()
+        with mock.patch.object(HTTPAdapter, 'send', side_effect=[response(s) for s in statuses]) as send:
+            result = adapter.send(request)
+        return result, send.call_count
+
+    def test_post_is_not_retried_after_a_server_error(self):
+        result, calls = self.send('POST', [502, 201])
+        self.assertEqual((result.status_code, calls, result.governor_retries), (502, 1, 0))
+
+    def test_post_is_retried_when_throttled(self):
+        result, calls = self.send('POST', [503, 201])
+        self.assertEqual((result.status_code, calls, result.governor_retries), (201, 2, 1))
+
+    def test_get_is_retried_after_a_server_error(self):
+        result, calls = self.send('GET', [502, 504, 200])
+        self.assertEqual((result.status_code, calls, result.governor_retries), (200, 3, 2))
+
+    def test_post_is_not_retried_after_a_connection_error(self):
+        adapter = GovernedAdapter(governor=RateGovernor(), retries=3)
+        request = requests.Request('POST', 'http://icp.test/finance/costs', json={}).prepare()
+        with mock.patch.object(HTTPAdapter, 'send', side_effect=requests.exceptions.ConnectionError) as send:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                adapter.send(request)
+        self.assertEqual(send.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
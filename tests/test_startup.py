@@ -0,0 +1,49 @@
+"""
+The `icp` command starts without importing the scripts and their dependencies
+
+The time budget itself is checked by `python benchmarks/run.py --startup-only`, this test catches
+the usual cause of a slow start, a heavy import reached from the CLI, without timing anything.
+"""
+import subprocess
+import sys
+import unittest
+from os.path import join, dirname, abspath
+
+ROOT = abspath(join(dirname(__file__), '..'))
+
+# modules a subcommand may import when it runs, but `--help` must not
+HEAVY_MODULES = ('requests', 'urllib3', 'openpyxl', 'dotenv', 'dateutil', 'orjson', 'icp.client', 'icp.scripts')
+
+CHECK = """
+import sys
+from icp import cli
+try:
+    cli.main({argv!r})
+except SystemExit:
+    pass
+print()
+print(','.join(name for name in {modules!r} if name in sys.modules))
+"""
+
+
+def loaded_modules(argv):
+    """
+    :return: Heavy modules imported by running `icp <argv>` in a fresh interpreter
+    """
+    result = subprocess.run([sys.executable, '-c', CHECK.format(argv=argv, modules=HEAVY_MODULES)],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    # the last line, after the help text
+    return [name for name in result.stdout.splitlines()[-1].split(',') if name]
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_help_imports_no_script(self):
+        self.assertEqual(loaded_modules(['--help']), [])
+
+    def test_subcommand_help_imports_no_script(self):
+        self.assertEqual(loaded_modules(['import-costs', '--help']), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+"""
+Pre-flight validation reads CSV files the way the import does
+"""
+import sys
+import tempfile
+import unittest
+from os.path import join, dirname
+
+sys.path.insert(0, join(dirname(__file__), '..'))
+from icp.journal import read_csv
+from icp.validation import validate_csv
+
+SCHEMA = (
+    ('name', 'text', True),
+    ('email', 'email', True),
+)
+
+
+class BomTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.csv_path = join(directory.name, 'contractors.csv')
+        # Excel saves "CSV UTF-8" with a byte order mark before the first column name
+        with open(self.csv_path, 'w', newline='', encoding='utf-8-sig') as f:
+            f.write("name,email\r\nContractor 1,c1@example.com\r\n")
+
+    def test_bom_is_not_part_of_the_first_column(self):
+        report = validate_csv(self.csv_path, SCHEMA)
+        self.assertTrue(report.ok, report.errors)
+        self.assertEqual(report.rows, 1)
+
+    def test_validation_and_import_read_the_same_header(self):
+        header, rows = read_csv(self.csv_path)
+        list(rows)
+        self.assertEqual(header, ['name', 'email'])
+        self.assertTrue(validate_csv(self.csv_path, SCHEMA).ok)
+
+
+if __name__ == '__main__':
+    unittest.main()